@@ -9,20 +9,41 @@ usage: pyftanalysis [options] inputfile
     -s State: print the graphics state after executing prep
     -c CallGraph: print out the call graph
     -m MaxStackDepth: print out the maximum stack depth for the executed code
+       (without -i, from the static stack effects where they are enough)
     -p Prep: print out prep bytecodes/IR
     -f Functions: print out function bytecodes/IR
     -z Glyphs: print out selected glyph bytecode/IR
     -g NAME Glyph: execute prep plus hints for glyph NAME
     -G AllGlyphs: execute prep plus hints for all glyphs in font
-    -r Reduce: remove uncalled functions
+    -j N Jobs: execute glyph programs in N worker processes
+    -r Reduce: remove uncalled functions (from every font of a .ttc at once)
     --cvt CVT: print the CVT after executing prep
+    --compact Compact: only make statements for the code that gets executed
+    --cache DIR Cache: keep glyph results in DIR, only executing changed glyphs again
+    --ppem SIZES Ppem: run prep and the glyph programs concretely at each
+       size of SIZES (e.g. 8-72 or 9,12,16-20) and print, per size, a line
+       of JSON with the CVT, storage and IF outcomes, and what stopped
+    --profile FILE Profile: count the instructions executed per program and
+       function, print them (inclusive and exclusive) and write them to FILE
+       as collapsed stacks, for flame graphs
+    --callgraph FILE CallGraphFile: write the call graph, and which glyphs
+       reach each function, to FILE (as DOT if it ends in .dot, else JSON)
     -v Verbose: be more verbose
+
+    Batch options:
+    --batch FILE Batch: analyse every font given (directories are searched
+       for fonts, other files list one font per line) and write one line
+       of JSON per font (per font of a collection) to FILE; -j N analyses
+       N fonts at a time
+    --timeout SECONDS Timeout: in batch mode, give up on fonts taking longer
 """
 
 from __future__ import print_function, division, absolute_import
 from fontTools.ttLib import TTFont
+from fontTools.ttLib.sfnt import TTCWriter
 from fontTools.ttLib.bytecodeContainer import BytecodeContainer
-from fontTools.ttLib.instructions import statements, abstractExecute
+from fontTools.ttLib.instructions import statements, abstractExecute, stackEffect, concreteExecute
+from fontTools.analysisCache import AnalysisCache
 from fontTools.ttLib.data import dataType
 from fontTools.misc.util import makeOutputFileName
 import sys
@@ -32,41 +53,236 @@ import math
 import pdb
 import logging
 import copy
-import tempfile
-
-def ttDump(input):
-    output = tempfile.TemporaryFile(suffix=".ttx")
-    ttf = TTFont(input, 0, verbose=False, allowVID=False,
-            quiet=False, ignoreDecompileErrors=True,
-            fontNumber=-1)
-    ttf.saveXML(output, quiet=True, tables= [],
-                skipTables= [], splitTables=False,
-                disassembleInstructions=True,
-                bitmapGlyphDataFormat='raw',
-                leaveOpen=True)
-    ttf.close()
-    return output
+import multiprocessing
+import json
+import struct
+import time
+import traceback
 
-def executeGlyphs(abstractExecutor, initialEnvironment, glyphs):
-    called_functions = set()
-    for glyph in glyphs:
+def openFont(input, fontNumber=-1):
+    # binary fonts are read directly (and lazily); only the tables
+    # BytecodeContainer asks for ever get decompiled
+    if input.split('.')[-1] == 'ttx':
+        tt = TTFont()
+        tt.importXML(input, quiet=True)
+    else:
+        tt = TTFont(input, lazy=True, ignoreDecompileErrors=True, fontNumber=fontNumber)
+    return tt
+
+def allGlyphs(bc):
+    return filter(lambda x: x != 'fpgm' and x != 'prep', bc.tag_to_programs.keys())
+
+def removeUncalledFunctions(bc, called_functions):
+    unused_functions = [item for item in bc.function_table.keys() if item not in called_functions]
+    bc.removeFunctions(unused_functions)
+
+def reducedFileName(input, extension):
+    directory, fileName = os.path.split(input)
+    return makeOutputFileName(os.path.join(directory, "Reduced" + fileName), extension)
+
+def executeGlyph(abstractExecutor, initialEnvironment, glyph):
+    '''
+    Executes the program of 'glyph', starting from initialEnvironment.
+    Returns what that adds to the analysis, for mergeGlyphResults:
+    (glyph, the IRs of the glyph and of the functions it was the first
+    to visit, the functions it called, call counts, call graph, maximum
+    stack depth, error). error is None, or why an error in the glyph's
+    program (an abstractExecute.ProgramError) stopped it; it then has no
+    IR.
+    '''
+    IRs = abstractExecutor.bytecodeContainer.IRs
+    already_visited = set(abstractExecutor.visited_functions)
+    function_table = abstractExecutor.global_function_table
+    call_graph = abstractExecutor.call_graph
+    maximum_stack_depth = abstractExecutor.maximum_stack_depth
+    abstractExecutor.global_function_table = {}
+    abstractExecutor.call_graph = {}
+    abstractExecutor.maximum_stack_depth = 0
+    try:
         abstractExecutor.environment = copy.deepcopy(initialEnvironment)
-        abstractExecutor.execute(glyph)
-        called_functions.update(list(set(abstractExecutor.program.call_function_set)))
+        new_IRs = {}
+        error = None
+        try:
+            abstractExecutor.execute(glyph)
+            new_IRs[glyph] = IRs[glyph]
+        except abstractExecute.ProgramError as e:
+            error = str(e)
+            abstractExecutor.call_stack = []
+        for tag in abstractExecutor.visited_functions - already_visited:
+            new_IRs[tag] = IRs[tag]
+        return (glyph, new_IRs, abstractExecutor.program.call_function_set,
+                abstractExecutor.global_function_table, abstractExecutor.call_graph,
+                abstractExecutor.maximum_stack_depth, error)
+    finally:
+        abstractExecutor.global_function_table = function_table
+        abstractExecutor.call_graph = call_graph
+        abstractExecutor.maximum_stack_depth = max(maximum_stack_depth,
+                                                   abstractExecutor.maximum_stack_depth)
+
+def mergeGlyphResults(abstractExecutor, results):
+    '''
+    Accounts for the results of executeGlyph in the analysis, in order;
+    returns the functions called.
+    '''
+    bc = abstractExecutor.bytecodeContainer
+    called_functions = set()
+    for glyph, IRs, call_function_set, function_table, call_graph, maximum_stack_depth, error in results:
+        if error is not None:
+            abstractExecutor.errors[glyph] = error
+        for tag, IR in IRs.items():
+            if tag == glyph or tag not in bc.IRs:
+                bc.IRs[tag] = IR
+            if tag != glyph:
+                abstractExecutor.visited_functions.add(tag)
+        bc.tag_to_programs[glyph].call_function_set = call_function_set
+        called_functions.update(call_function_set)
+        for callee, count in function_table.items():
+            abstractExecutor.global_function_table[callee] = \
+                abstractExecutor.global_function_table.get(callee, 0) + count
+        for caller, callees in call_graph.items():
+            merged = abstractExecutor.call_graph.setdefault(caller, {})
+            for callee, count in callees.items():
+                merged[callee] = merged.get(callee, 0) + count
+        abstractExecutor.maximum_stack_depth = max(abstractExecutor.maximum_stack_depth,
+                                                   maximum_stack_depth)
     return called_functions
 
-def analysis(bytecodeContainer, glyphs):
+def executeGlyphs(abstractExecutor, initialEnvironment, glyphs):
+    results = [executeGlyph(abstractExecutor, initialEnvironment, glyph) for glyph in glyphs]
+    return mergeGlyphResults(abstractExecutor, results)
+
+# per-worker state for executeGlyphsInParallel; the container and the
+# post-prep environment are handed to each worker once, at startup
+glyphWorkerState = None
+
+def initGlyphWorker(bytecodeContainer, initialEnvironment):
+    global glyphWorkerState
+    glyphWorkerState = (abstractExecute.Executor(bytecodeContainer), initialEnvironment)
+
+def executeGlyphWorker(glyph):
+    abstractExecutor, initialEnvironment = glyphWorkerState
+    return executeGlyph(abstractExecutor, initialEnvironment, glyph)
+
+def executeGlyphsInParallel(abstractExecutor, initialEnvironment, glyphs, processes):
+    '''the results of executeGlyph for glyphs, computed by worker processes'''
+    bc = abstractExecutor.bytecodeContainer
+    pool = multiprocessing.Pool(processes, initGlyphWorker, (bc, initialEnvironment))
+    try:
+        return pool.map(executeGlyphWorker, glyphs)
+    finally:
+        pool.close()
+        pool.join()
+
+def analysis(bytecodeContainer, glyphs, processes=1, cache=None, profile=None):
+    '''
+    Executes prep and then the programs of glyphs. Glyphs whose results
+    are in cache (an AnalysisCache) aren't executed again. With a
+    profile (an abstractExecute.InstructionProfile), every program is
+    executed, in this process, and counted into it.
+
+    An error in a program (a bad jump, a call to an undefined function)
+    stops only that program: it is logged, and kept in the executor's
+    errors (tag -> message).
+    '''
     abstractExecutor = abstractExecute.Executor(bytecodeContainer)
+    if profile is not None:
+        abstractExecutor.profile = profile
+        processes = 1
+        cache = None
     called_functions = set()
+    prep_call_function_set = []
     if 'prep' in bytecodeContainer.tag_to_programs:
-        abstractExecutor.execute('prep')
-        called_functions.update(list(set(abstractExecutor.program.call_function_set)))
+        try:
+            abstractExecutor.execute('prep')
+        except abstractExecute.ProgramError as e:
+            # glyphs start from wherever prep stopped
+            abstractExecutor.errors['prep'] = str(e)
+            abstractExecutor.call_stack = []
+        prep_call_function_set = abstractExecutor.program.call_function_set
+        called_functions.update(list(set(prep_call_function_set)))
     # NB: if there's no prep we don't explicitly output the initial graphics state
 
     environment_after_prep = abstractExecutor.environment
-    called_functions.update(executeGlyphs(abstractExecutor, environment_after_prep, glyphs))
+    results = {}
+    if cache is not None:
+        cache.setPrep(prep_call_function_set)
+        for glyph in glyphs:
+            result = cache.lookup(glyph)
+            if result is not None:
+                results[glyph] = result
+    missing = [glyph for glyph in glyphs if glyph not in results]
+    if processes > 1 and len(missing) > 1:
+        new_results = executeGlyphsInParallel(abstractExecutor, environment_after_prep,
+                                              missing, processes)
+    else:
+        new_results = [executeGlyph(abstractExecutor, environment_after_prep, glyph)
+                       for glyph in missing]
+    for result in new_results:
+        results[result[0]] = result
+        if cache is not None:
+            cache.store(result)
+    called_functions.update(mergeGlyphResults(abstractExecutor,
+                                              [results[glyph] for glyph in glyphs]))
+
+    if cache is not None:
+        # functions only cached glyphs called haven't been visited
+        for callee in called_functions:
+            tag = "fpgm_%s" % callee
+            if tag not in bytecodeContainer.IRs:
+                IR = cache.functionIR(callee)
+                if IR is not None:
+                    bytecodeContainer.IRs[tag] = IR
+                    abstractExecutor.visited_functions.add(tag)
+        cache.storeFunctionIRs(bytecodeContainer.IRs, called_functions)
+        cache.save()
+    for tag, error in sorted(abstractExecutor.errors.items()):
+        logging.error("%s: %s", tag, error)
     return abstractExecutor, called_functions
 
+def callGraph(abstractExecutor, glyphs):
+    '''
+    The call graph of an analysis, as exported by --callgraph:
+    "calls" maps each program (prep, glyphs, fpgm_N) to the number of
+    calls it makes to each function, and "reached_by" maps each function
+    to prep and the glyphs that end up calling it, directly or not.
+    '''
+    bc = abstractExecutor.bytecodeContainer
+    calls = {}
+    for caller, callees in abstractExecutor.call_graph.items():
+        calls[caller] = dict((str(callee), count) for callee, count in callees.items())
+    reached_by = {}
+    programs = list(glyphs)
+    if 'prep' in bc.tag_to_programs:
+        programs.insert(0, 'prep')
+    for program in programs:
+        for callee in set(bc.tag_to_programs[program].call_function_set):
+            reached_by.setdefault(str(callee), []).append(program)
+    return {"calls": calls, "reached_by": reached_by}
+
+def writeCallGraph(graph, fileName):
+    '''writes graph (see callGraph) as DOT if fileName ends in .dot, else as JSON'''
+    with open(fileName, "w") as f:
+        if fileName.split('.')[-1] != 'dot':
+            json.dump(graph, f, indent=1, sort_keys=True)
+            f.write("\n")
+            return
+        f.write("digraph calls {\n")
+        for caller, callees in sorted(graph["calls"].items()):
+            for callee, count in sorted(callees.items(), key=lambda item: int(item[0])):
+                f.write('  "%s" -> "fpgm_%s" [label=%d];\n' % (caller, callee, count))
+        f.write("}\n")
+
+def parseSizes(sizes):
+    '''"9,12,16-20" -> [9, 12, 16, 17, 18, 19, 20]'''
+    result = []
+    for part in sizes.split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            result.extend(range(int(first), int(last) + 1))
+        else:
+            result.append(int(part))
+    return result
+
 class Options(object):
     verbose = False
     outputState = False
@@ -80,6 +296,14 @@ class Options(object):
     glyphs = []
     allGlyphs = False
     reduceFunctions = False
+    processes = 1
+    compact = False
+    cacheDirectory = None
+    callGraphFile = None
+    ppems = []
+    profileFile = None
+    batchOutput = None
+    timeout = None
 
     def __init__(self, rawOptions, numFiles):
         for option, value in rawOptions:
@@ -94,6 +318,20 @@ class Options(object):
                 self.outputState = True
             elif option == "--cvt":
                 self.outputCVT = True
+            elif option == "--compact":
+                self.compact = True
+            elif option == "--cache":
+                self.cacheDirectory = value
+            elif option == "--ppem":
+                self.ppems = parseSizes(value)
+            elif option == "--profile":
+                self.profileFile = value
+            elif option == "--callgraph":
+                self.callGraphFile = value
+            elif option == "--batch":
+                self.batchOutput = value
+            elif option == "--timeout":
+                self.timeout = float(value)
             elif option == "-c":
                 self.outputCallGraph = True
             elif option == "-m":
@@ -112,6 +350,8 @@ class Options(object):
                 self.verbose = True
             elif option == "-r":
                 self.reduceFunctions = True
+            elif option == "-j":
+                self.processes = int(value)
 
         if (self.verbose):
             logging.basicConfig(level = logging.INFO)
@@ -123,24 +363,90 @@ def usage():
     print(__doc__ % version)
     sys.exit(2)
 
+def reduceCollection(input, options):
+    '''
+    Removes the functions no glyph of any font of the collection calls.
+    Fonts sharing their fpgm, prep, cvt and glyf tables are analysed
+    once, and an fpgm shared by several fonts is rewritten once.
+    '''
+    fonts = [openFont(input, 0)]
+    for fontNumber in range(1, fonts[0].reader.numFonts):
+        fonts.append(openFont(input, fontNumber))
+
+    # (fpgm, prep, cvt, glyf) offsets -> functions called
+    analysed = {}
+    # fpgm offset -> functions called by any font using it
+    called = {}
+    # fpgm offset -> (BytecodeContainer, font) to rewrite it with
+    containers = {}
+    def tableOffset(tt, tag):
+        if tag in tt.reader:
+            return tt.reader.tables[tag].offset
+        return None
+    for tt in fonts:
+        key = tuple(tableOffset(tt, tag) for tag in ('fpgm', 'prep', 'cvt ', 'glyf'))
+        if key not in analysed:
+            bc = BytecodeContainer(tt, options.compact)
+            ae, analysed[key] = analysis(bc, allGlyphs(bc), options.processes)
+            if key[0] not in containers:
+                containers[key[0]] = (bc, tt)
+        called.setdefault(key[0], set()).update(analysed[key])
+
+    fpgms = {}
+    for fpgm, (bc, tt) in containers.items():
+        if fpgm is not None:
+            removeUncalledFunctions(bc, called[fpgm])
+            bc.replaceFpgm(tt)
+            fpgms[fpgm] = tt['fpgm'].compile(tt)
+
+    writer = TTCWriter(open(reducedFileName(input, ".ttc"), "wb"))
+    for tt in fonts:
+        tables = {}
+        for tag in tt.reader.keys():
+            if tag == 'fpgm':
+                tables[tag] = fpgms[tableOffset(tt, tag)]
+            else:
+                tables[tag] = tt.reader[tag]
+        writer.addFont(tables, tt.sfntVersion)
+    writer.close()
+    writer.file.close()
+    for tt in fonts:
+        tt.close()
+
 def process(jobs, options):
     for input in jobs:
-        tt = TTFont()
-        tt.importXML(input, quiet=True)
-        bc = BytecodeContainer(tt)
+        if input.split('.')[-1] == 'ttc':
+            reduceCollection(input, options)
+            continue
+
+        tt = openFont(input)
+        bc = BytecodeContainer(tt, options.compact)
+        cache = None
+        if options.cacheDirectory is not None:
+            cache = AnalysisCache(os.path.join(options.cacheDirectory,
+                                               os.path.basename(input) + ".ircache"), tt, bc)
 
         if (options.allGlyphs):
-            glyphs = filter(lambda x: x != 'fpgm' and x != 'prep', bc.tag_to_programs.keys())
+            glyphs = allGlyphs(bc)
         else:
             glyphs = map(lambda x: 'glyf.'+x, options.glyphs)
 
-        if options.outputIR:
-            ae, called_functions = analysis(bc, glyphs)
+        profile = None
+        if options.profileFile is not None:
+            profile = abstractExecute.InstructionProfile()
+        if options.reduceFunctions:
+            # every glyph's calls count when removing functions
+            ae, called_functions = analysis(bc, allGlyphs(bc), options.processes, cache, profile)
+        elif (options.outputIR or options.callGraphFile is not None or
+              options.profileFile is not None):
+            ae, called_functions = analysis(bc, glyphs, options.processes, cache, profile)
 
         if (options.outputPrep):
             print ("PREP:")
             if (options.outputIR):
-                if 'prep' in bc.tag_to_programs:
+                if 'prep' in ae.errors:
+                    print ("  <stopped: %s>" % ae.errors['prep'])
+                elif 'prep' in bc.tag_to_programs:
                     bc.print_IR(bc.IRs['prep'])
                 else:
                     print ("  <no prep>")
@@ -163,7 +469,10 @@ def process(jobs, options):
             for glyph in glyphs:
                 print ("%s:" % glyph)
                 if (options.outputIR):
-                    bc.print_IR(bc.IRs[glyph])
+                    if glyph in ae.errors:
+                        print ("  <stopped: %s>" % ae.errors[glyph])
+                    else:
+                        bc.print_IR(bc.IRs[glyph])
                 else:
                     bc.tag_to_programs[glyph].body.pretty_print()
                 print ()
@@ -175,31 +484,198 @@ def process(jobs, options):
             for item in ae.global_function_table.items():
                 print (item)
 
+        if options.callGraphFile is not None:
+            if options.reduceFunctions:
+                writeCallGraph(callGraph(ae, allGlyphs(bc)), options.callGraphFile)
+            else:
+                writeCallGraph(callGraph(ae, glyphs), options.callGraphFile)
+
+        if profile is not None:
+            print("profile (instructions executed, inclusive and exclusive):")
+            for tag, (inclusive, exclusive) in sorted(profile.flat().items(),
+                                                      key=lambda item: (-item[1][0], item[0])):
+                print("%10d %10d  %s" % (inclusive, exclusive, tag))
+            with open(options.profileFile, "w") as f:
+                profile.write_collapsed(f)
+
+        if options.ppems:
+            results = concreteExecute.simulate(bc, tt['head'].unitsPerEm, options.ppems, glyphs)
+            for result in results:
+                print(json.dumps(result, sort_keys=True))
+
         if (options.outputState):
             ae.environment.pretty_print()
         if (options.outputCVT):
             print("CVT = ", ae.environment.cvt)
         if (options.outputMaxStackDepth):
-            print("Max Stack Depth =", ae.maximum_stack_depth)
+            if options.outputIR or options.reduceFunctions:
+                maximum_stack_depth = ae.maximum_stack_depth
+            else:
+                maximum_stack_depth = stackEffect.maximumStackDepth(bc, glyphs)
+                if maximum_stack_depth is None:
+                    ae, called_functions = analysis(bc, glyphs, options.processes, cache)
+                    maximum_stack_depth = ae.maximum_stack_depth
+            print("Max Stack Depth =", maximum_stack_depth)
         if (options.reduceFunctions):
-            if not options.allGlyphs:
-                glyphs = filter(lambda x: x != 'fpgm' and x != 'prep', bc.tag_to_programs.keys())
-                called_functions.update(executeGlyphs(ae, glyphs)) 
-            
-            function_set = ae.environment.function_table.keys()
-            unused_functions = [item for item in function_set if item not in called_functions]
-          
-            bc.removeFunctions(unused_functions)
+            # the analysis only read the tables it loaded, and updateTTFont
+            # marks those it changes: the others are copied as they are
+            for tag in tt.keys():
+                if tag != 'GlyphOrder' and tt.isLoaded(tag):
+                    tt[tag].dirty = False
+            removeUncalledFunctions(bc, called_functions)
             bc.updateTTFont(tt)
-            output = "Reduced"+input
-            output = makeOutputFileName(output, ".ttf")
-            tt.save(output)
-        if type(input) is file:
-            input.close()
+            tt.save(reducedFileName(input, ".ttf"), reuseUnmodified=True)
+        tt.close()
+
+def fontSummary(input, options, fontNumber=-1):
+    '''
+    Analyses the glyphs of font 'input' (all of them, unless -g), or of
+    its font fontNumber if it's a collection, and returns what batch
+    writes out about it.
+    '''
+    start = time.time()
+    tt = openFont(input, fontNumber)
+    try:
+        bc = BytecodeContainer(tt, options.compact)
+        cache = None
+        if options.cacheDirectory is not None:
+            cacheName = os.path.basename(input)
+            if fontNumber >= 0:
+                cacheName += "#%d" % fontNumber
+            cache = AnalysisCache(os.path.join(options.cacheDirectory,
+                                               cacheName + ".ircache"), tt, bc)
+        if options.glyphs:
+            glyphs = map(lambda x: 'glyf.'+x, options.glyphs)
+        else:
+            glyphs = allGlyphs(bc)
+        ae, called_functions = analysis(bc, glyphs, 1, cache)
+        graph = callGraph(ae, glyphs)
+        summary = {
+            "font": input,
+            "glyphs": len(glyphs),
+            "functions": len(bc.function_table),
+            "call_graph": dict((str(callee), count)
+                               for callee, count in ae.global_function_table.items()),
+            "calls": graph["calls"],
+            "reached_by": graph["reached_by"],
+            "unused_functions": sorted(item for item in bc.function_table.keys()
+                                       if item not in called_functions),
+            "max_stack_depth": ae.maximum_stack_depth,
+            "program_errors": ae.errors,
+            "seconds": round(time.time() - start, 3),
+        }
+        if fontNumber >= 0:
+            summary["font_number"] = fontNumber
+        return summary
+    finally:
+        tt.close()
+
+def batchWorker(input, fontNumber, options, connection):
+    try:
+        result = fontSummary(input, options, fontNumber)
+    except Exception as e:
+        result = {"font": input, "error": "%s: %s" % (type(e).__name__, e),
+                  "traceback": traceback.format_exc()}
+    connection.send(result)
+    connection.close()
+
+def collectionFonts(input):
+    '''
+    The font numbers batch analyses in 'input': each font of a
+    TrueType Collection, or -1 for a single font.
+    '''
+    if input.split('.')[-1] == 'ttx':
+        return [-1]
+    with open(input, "rb") as f:
+        header = f.read(12)
+    if len(header) < 12 or header[:4] != b"ttcf":
+        return [-1]
+    return range(struct.unpack(">L", header[8:12])[0])
+
+def collectFonts(paths):
+    '''
+    The fonts to analyse in batch mode: directories are searched for
+    fonts, and files that aren't fonts list one font per line (relative
+    to the list; blank lines and lines starting with # are skipped).
+    '''
+    fonts = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, files in os.walk(path):
+                subdirectories.sort()
+                for name in sorted(files):
+                    if name.split('.')[-1] in ('ttf', 'ttx', 'ttc'):
+                        fonts.append(os.path.join(directory, name))
+        elif path.split('.')[-1] in ('ttf', 'ttx', 'ttc'):
+            fonts.append(path)
+        else:
+            with open(path) as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        fonts.append(os.path.join(os.path.dirname(path), line))
+    return fonts
+
+def batch(jobs, options):
+    '''
+    Analyses each font of jobs in a process of its own, options.processes
+    at a time, and writes a line of JSON per font to options.batchOutput
+    as they finish; each font of a collection gets its own line, with
+    its "font_number". Fonts whose analysis fails, takes longer than
+    options.timeout seconds or kills its process get a line with an
+    "error" instead.
+    '''
+    output = open(options.batchOutput, "w")
+    pending = []
+    for input in jobs:
+        try:
+            pending.extend((input, fontNumber) for fontNumber in collectionFonts(input))
+        except IOError:
+            # the worker reports it
+            pending.append((input, -1))
+    pending.reverse()
+    # process -> (font, font number, connection, start time)
+    running = {}
+    def write(result):
+        output.write(json.dumps(result, sort_keys=True) + "\n")
+        output.flush()
+    try:
+        while pending or running:
+            while pending and len(running) < max(options.processes, 1):
+                input, fontNumber = pending.pop()
+                receiver, sender = multiprocessing.Pipe(False)
+                process = multiprocessing.Process(target=batchWorker,
+                                                  args=(input, fontNumber, options, sender))
+                process.start()
+                sender.close()
+                running[process] = (input, fontNumber, receiver, time.time())
+            for process, (input, fontNumber, receiver, start) in running.items():
+                if receiver.poll():
+                    try:
+                        result = receiver.recv()
+                    except EOFError:
+                        result = {"font": input,
+                                  "error": "worker exited with code %s" % process.exitcode}
+                elif options.timeout is not None and time.time() - start > options.timeout:
+                    process.terminate()
+                    result = {"font": input, "error": "timed out after %g seconds" % options.timeout}
+                else:
+                    continue
+                if fontNumber >= 0:
+                    result["font_number"] = fontNumber
+                process.join()
+                receiver.close()
+                del running[process]
+                write(result)
+            time.sleep(0.01)
+    finally:
+        for process in running:
+            process.terminate()
+        output.close()
 
 def parseOptions(args):
     try:
-        rawOptions, files = getopt.getopt(args, "hiscpfzGmg:vr", ['cvt'])
+        rawOptions, files = getopt.getopt(args, "hiscpfzGmg:vrj:", ['cvt', 'compact', 'cache=', 'ppem=', 'profile=', 'callgraph=', 'batch=', 'timeout='])
     except getopt.GetoptError:
         usage()
 
@@ -208,22 +684,28 @@ def parseOptions(args):
 
     options = Options(rawOptions, len(files))
     jobs = []
+    if options.batchOutput is not None:
+        files = collectFonts(files)
 
     for input in files:
         fileformat = input.split('.')[-1]
-        if fileformat == 'ttf':
-            output = ttDump(input)
-            output.seek(0)
-            jobs.append(output)
-        elif fileformat == 'ttx':
+        if fileformat == 'ttf' or fileformat == 'ttx' or fileformat == 'ttc':
             jobs.append(input)
         else:
             raise NotImplementedError
+        if (fileformat == 'ttc' and options.batchOutput is None and
+            not options.reduceFunctions):
+            print("pyftanalysis: %s: font collections can only be reduced (-r) or batch "
+                  "analysed (--batch)" % input, file=sys.stderr)
+            sys.exit(2)
     return jobs, options
 
 def main(args):
     jobs, options = parseOptions(args)
-    process(jobs, options)
+    if options.batchOutput is not None:
+        batch(jobs, options)
+    else:
+        process(jobs, options)
     
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,128 @@
+"""
+On-disk cache of pyftanalysis results.
+
+The result of executing a glyph program (its IR, the functions it
+calls, the call counts and its maximum stack depth) only depends on
+the glyph's instructions, the state after prep and the functions it
+calls. An AnalysisCache keeps these results per glyph, keyed by
+hashes of all three, so that a glyph is only executed again when one
+of them changed.
+"""
+
+from __future__ import print_function, division, absolute_import
+import array
+import hashlib
+import os
+import cPickle as pickle
+
+# bump when the IR or the cached results change shape
+CACHE_VERSION = 3
+
+def digest(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part))
+        h.update("\0")
+    return h.hexdigest()
+
+class AnalysisCache(object):
+    '''
+    Results of executing the glyph programs of one font, saved in 'path'.
+
+    results: glyph tag -> (glyph hash, prep key, {callee: function hash},
+             result), where result is as returned by analysis.executeGlyph
+    function_IRs: function tag -> (function hash, prep key, IR), for the
+             functions cached glyphs called
+    '''
+    def __init__(self, path, tt, bytecodeContainer):
+        self.path = path
+        self.tt = tt
+        self.bytecodeContainer = bytecodeContainer
+        self.results = {}
+        self.function_IRs = {}
+        self.function_hashes = {}
+        self.prep_key = None
+        self.dirty = False
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                try:
+                    version, self.results, self.function_IRs = pickle.load(f)
+                except (pickle.UnpicklingError, EOFError, ValueError):
+                    version = None
+            if version != CACHE_VERSION:
+                self.results = {}
+                self.function_IRs = {}
+
+    def functionHash(self, callee):
+        if callee not in self.function_hashes:
+            function_table = self.bytecodeContainer.function_table
+            if callee not in function_table:
+                return None
+            # hash the bytecode, so that a compact function does not
+            # have to make its statements
+            bytecode = array.array('B')
+            function_table[callee].assemble(bytecode.append)
+            self.function_hashes[callee] = digest(bytecode.tostring())
+        return self.function_hashes[callee]
+
+    def glyphHash(self, tag):
+        glyph = self.tt['glyf'][tag[len('glyf.'):]]
+        if not hasattr(glyph, 'program'):
+            return digest(b"")
+        return digest(glyph.program.getBytecode())
+
+    def calleeHashes(self, callees):
+        return dict((callee, self.functionHash(callee)) for callee in set(callees))
+
+    def setPrep(self, prep_call_function_set):
+        '''
+        Call once prep has been executed (with the functions it called):
+        the state glyphs start from depends on prep, the cvt and these.
+        '''
+        prep = b""
+        if 'prep' in self.tt:
+            prep = self.tt['prep'].program.getBytecode()
+        self.prep_key = digest(prep, sorted(self.bytecodeContainer.cvt_table.items()),
+                               sorted(self.calleeHashes(prep_call_function_set).items()))
+
+    def lookup(self, tag):
+        '''the cached result for glyph 'tag', or None if it is stale'''
+        if tag not in self.results:
+            return None
+        glyph_hash, prep_key, callee_hashes, result = self.results[tag]
+        if prep_key != self.prep_key or glyph_hash != self.glyphHash(tag):
+            return None
+        for callee, function_hash in callee_hashes.items():
+            if self.functionHash(callee) != function_hash:
+                return None
+        return result
+
+    def store(self, result):
+        tag, IRs, call_function_set = result[:3]
+        self.results[tag] = (self.glyphHash(tag), self.prep_key,
+                             self.calleeHashes(call_function_set), result)
+        self.dirty = True
+
+    def storeFunctionIRs(self, IRs, called_functions):
+        for callee in called_functions:
+            tag = "fpgm_%s" % callee
+            if tag in IRs:
+                self.function_IRs[tag] = (self.functionHash(callee), self.prep_key, IRs[tag])
+                self.dirty = True
+
+    def functionIR(self, callee):
+        '''the cached IR of function 'callee', or None'''
+        tag = "fpgm_%s" % callee
+        if tag not in self.function_IRs:
+            return None
+        function_hash, prep_key, IR = self.function_IRs[tag]
+        if function_hash != self.functionHash(callee) or prep_key != self.prep_key:
+            return None
+        return IR
+
+    def save(self):
+        if not self.dirty:
+            return
+        with open(self.path, "wb") as f:
+            pickle.dump((CACHE_VERSION, self.results, self.function_IRs), f, pickle.HIGHEST_PROTOCOL)
+        self.dirty = False
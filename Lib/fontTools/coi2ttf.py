@@ -6,16 +6,18 @@ usage: coi2ttf input [fontfile]
     fontfile: original TTF font file for given COI code. If
               passed, an updated version of the font will
               be generated using the COI code to build tables
+
+    The input is read one program at a time; each program is turned
+    into bytecode, and put into the font, as soon as it ends.
 """
 
 import sys
 import re
 import os
-import copy
+import array
 from fontTools.ttLib import TTFont
-from fontTools.ttLib.bytecodeContainer import BytecodeContainer, Program
-from fontTools.ttLib.instructions import instructionConstructor
-from fontTools.ttLib.instructions.instructionConstructor import constructInstructions
+from fontTools.ttLib.tables import ttProgram
+from fontTools.misc.textTools import binary2num
 
 def usage():
     print(__doc__)
@@ -68,44 +70,61 @@ class AssignInstruction(object):
         
 
 class Instruction(object):
+    """
+    A translated instruction: a ttProgram mnemonic with its argument
+    bits ("" if it takes none), or PUSH with the list of values it
+    pushes. data is None for COI lines that have no translation.
+    """
 
-    def __init__(self, mnemonic, data, line):
+    def __init__(self, mnemonic, data=""):
         self.mnemonic = mnemonic
         self.data = data
-        self.line = line
+
+    def __str__(self):
+        if self.data is None:
+            return self.mnemonic
+        if self.mnemonic == "PUSH":
+            lines = ["PUSH[ ]"]
+            if len(self.data) > 1:
+                lines[0] += "  /* %s values pushed */" % len(self.data)
+            lines.extend(str(value) for value in self.data)
+            return "\n".join(lines)
+        return "{0}[{1}]".format(self.mnemonic, self.data or " ")
+
     def __repr__(self):
-        return("{0}[{1}], line {2}".format(self.mnemonic, self.data, self.line))
+        return "Instruction({0!r}, {1!r})".format(self.mnemonic, self.data)
 
 # InstructionInterpreter will translate 
 class InstructionInterpreter(object):
     bytecodeInstructions = [] # contains the translated TTF so far
 
+    # (pattern, mnemonic, whether the last word of the line is its argument)
     pattern_markers = [
-        ("scan_control",         "SCANCTRL[ ]"),
-        ("scan_type",            "SCANTYPE[ ]"),
-        ("freedom_vector",       "SFVTCA[{0}]"),
-        ("projection_vector",    "SPVTCA[{0}]"),
-        ("single_width_cutin",   "SCVTCI[ ]"),
-        ("single_width_value",   "SSW[ ]"),
-        (":= cvt_table",         "RCVT[ ]"),
-        ("cvt_table",            "WCVTP[ ]"),
-        (":= storage_area",      "RS[ ]"),
-        ("storage_area",         "WS[ ]"),
-        ("instruction_control",  "INSTCTRL[ ]"),
-        ("RoundState_G",         "RTG[ ]"),
-        ("RoundState_HG",        "RTHG[ ]"),
-        ("RoundState_UG",        "RUTG[ ]"),
-        ("RoundState_DG",        "RTDG[ ]"),
-        ("RoundState_DTG",       "RDTG[ ]"),
-        ("Super45(",             "S45ROUND[ ]"),
-        ("Super(",               "SROUND[ ]"),
-        ("PPEM",                 "MPPEM[ ]"),
-        ("PointSize",            "MPS[ ]"),
-        ("GS[auto_flip] := true","FLIPON[ ]"),
-        ("GS[auto_flip] := false","FLIPOFF[ ]"),
-        ("GS[rp0]",              "SRP0[ ]"),
-        ("GS[rp1]",              "SRP1[ ]"),
-        ("GS[rp2]",              "SRP2[ ]")
+        ("scan_control",         "SCANCTRL",  False),
+        ("scan_type",            "SCANTYPE",  False),
+        ("freedom_vector",       "SFVTCA",    True),
+        ("projection_vector",    "SPVTCA",    True),
+        ("single_width_cutin",   "SCVTCI",    False),
+        ("single_width_value",   "SSW",       False),
+        (":= cvt_table",         "RCVT",      False),
+        ("cvt_table",            "WCVTP",     False),
+        (":= storage_area",      "RS",        False),
+        ("storage_area",         "WS",        False),
+        ("instruction_control",  "INSTCTRL",  False),
+        ("RoundState_G",         "RTG",       False),
+        ("RoundState_HG",        "RTHG",      False),
+        ("RoundState_UG",        "RUTG",      False),
+        ("RoundState_DG",        "RTDG",      False),
+        ("RoundState_DTG",       "RDTG",      False),
+        ("Super45(",             "S45ROUND",  False),
+        ("Super(",               "SROUND",    False),
+        ("PPEM",                 "MPPEM",     False),
+        ("PointSize",            "MPS",       False),
+        ("GS[auto_flip] := true","FLIPON",    False),
+        ("GS[auto_flip] := false","FLIPOFF",  False),
+        ("GS[rp0]",              "SRP0",      False),
+        ("GS[rp1]",              "SRP1",      False),
+        ("GS[rp2]",              "SRP2",      False)
     ]
 
     operators = {
@@ -134,18 +153,16 @@ class InstructionInterpreter(object):
         if "_" in function_name:
             function = function_name.split("_")[0]
             param = function_name.split("_")[1]
-            instr = function+"["+param+"]"
+            instr = Instruction(function, param)
         else:
-            instr = function_name+"[ ]"
+            instr = Instruction(function_name)
         return instr
 
     def parse_assignment(self, line):
-        instr = line
-        for pattern, instruction in self.pattern_markers:
+        for pattern, mnemonic, takesArg in self.pattern_markers:
             if pattern in line:
-                instr = instruction.format(line.split()[-1])
-                break
-        return instr
+                return Instruction(mnemonic, line.split()[-1] if takesArg else "")
+        return None
 
     def split_line(self, line):
         parts = line.split()
@@ -174,22 +191,25 @@ class InstructionInterpreter(object):
                     if instruction.is_function():
                         instr = self.parse_function(instruction.addr2)
                     else:
-                        if instruction.is_assigning_var():
-                            instr = instruction.__str__()
-                        else:
-                            instr = "PUSH["+instruction.addr2+"]"
-                        if instruction_line != self.parse_assignment(instruction_line):
-                            instr = self.parse_assignment(instruction_line)
+                        instr = self.parse_assignment(instruction_line)
+                        if instr is None:
+                            if instruction.is_assigning_var():
+                                # merged into a stack instruction later
+                                instr = instruction
+                            else:
+                                instr = Instruction("PUSH", [int(instruction.addr2)])
 
                 else:
                     if instruction.is_unary():
-                        instr = instruction.addr2+"[ ]"
+                        instr = Instruction(instruction.addr2)
                     else:
                         operator = self.get_binary_op(instruction.op)
-                        instr = operator+"[ ]"
+                        instr = Instruction(operator)
             else:
 
                 instr = self.parse_assignment(instruction_line)
+                if instr is None:
+                    instr = Instruction(instruction_line, None)
 
         elif type(instruction) is CallInstruction:
             instr = self.parse_function(instruction.function)
@@ -198,24 +218,20 @@ class InstructionInterpreter(object):
            
     def merge(self):
 
+        # returns (index, instruction) for each instruction with mnemonic
         def find_instructions(mnemonic):
-            instructions = []
-            for index, instr in enumerate(self.bytecodeInstructions):
-                if instr.startswith(mnemonic):
-                    data = instr[instr.index("[") + 1:instr.index("]")]
-                    instructions.append(Instruction(mnemonic, data, index))
-            return instructions
+            return [(index, instr)
+                    for index, instr in enumerate(self.bytecodeInstructions)
+                    if type(instr) is Instruction and instr.mnemonic == mnemonic]
 
         def find_assignments():
-            pattern = re.compile('\$..*\$..*')
             instructions = []
             sequence = []
             first_index = -1
             for index, instr in enumerate(self.bytecodeInstructions):
-                if pattern.match(instr):
-                    addrs = instr.split(" := ")
-                    addr1 = addrs[0].split("_")[-1]
-                    addr2 = addrs[1].split("_")[-1]
+                if type(instr) is AssignInstruction:
+                    addr1 = instr.addr1.split("_")[-1]
+                    addr2 = instr.addr2.split("_")[-1]
                     sequence.append(int(addr2)-int(addr1))
                     if first_index < 0:
                         first_index = index
@@ -230,24 +246,23 @@ class InstructionInterpreter(object):
             if len(instructions) == 0:
                 return
             data = []
-            last_line = instructions[-1].line
-            for instr in reversed(instructions):
-                if last_line - instr.line > 1:
-                    update_stack("PUSH[ ]", last_line, data)
-                    del data[:]
-                del self.bytecodeInstructions[instr.line]
-                data.append(instr.data)
-                last_line = instr.line
-            update_stack("PUSH[ ]", last_line, data)
+            last_line = instructions[-1][0]
+            for line, instr in reversed(instructions):
+                if last_line - line > 1:
+                    self.bytecodeInstructions.insert(last_line, Instruction("PUSH", data))
+                    data = []
+                del self.bytecodeInstructions[line]
+                data[:0] = instr.data
+                last_line = line
+            self.bytecodeInstructions.insert(last_line, Instruction("PUSH", data))
 
         def merge_SFVTCA():
             sfvInstructions = find_instructions("SFVTCA")
             spvInstructions = find_instructions("SPVTCA")
-            for fv in reversed(sfvInstructions):
-                for pv in reversed(spvInstructions):
-                    if fv.line == pv.line-1 and fv.data == pv.data:
-                        del self.bytecodeInstructions[fv.line:pv.line+1]
-                        update_stack("SVTCA[{0}]".format(fv.data), fv.line, [])
+            for fv_line, fv in reversed(sfvInstructions):
+                for pv_line, pv in reversed(spvInstructions):
+                    if fv_line == pv_line-1 and fv.data == pv.data:
+                        self.bytecodeInstructions[fv_line:pv_line+1] = [Instruction("SVTCA", fv.data)]
                         break
 
         # Merge instructions that push or pop values from the stack.
@@ -260,15 +275,19 @@ class InstructionInterpreter(object):
             instructions_groups = find_assignments()
             for instr_list, index in reversed(instructions_groups):
                 currentInstrs = []
+                # instructions inserted in front of the group
+                inserted = 0
                 
                 for instr in reversed(instr_list):
                     if not currentInstrs:
                         # DUP check
                         if instr == -1:
-                            update_stack("DUP[ ]", index, [])
+                            self.bytecodeInstructions.insert(index, Instruction("DUP"))
+                            inserted += 1
                         # CINDEX check
                         elif instr < -1:
-                            update_stack("CINDEX[ ]", index, [])
+                            self.bytecodeInstructions.insert(index, Instruction("CINDEX"))
+                            inserted += 1
                         else:
                             currentInstrs.append(instr)
                     else:
@@ -285,93 +304,117 @@ class InstructionInterpreter(object):
                             ):
                             # SWAP check (SWAP = MINDEX[] with 2 at top of stack)
                             if length == 3:
-                                update_stack("SWAP[ ]", index, [])
+                                self.bytecodeInstructions.insert(index, Instruction("SWAP"))
                             # ROLL check (ROLL = MINDEX[] with 3 at top of stack)
                             elif length == 4:
-                                update_stack("ROLL[ ]", index, [])
+                                self.bytecodeInstructions.insert(index, Instruction("ROLL"))
                             # MINDEX[] with  x > 3 at top of stack
                             else:
-                                update_stack("MINDEX[ ]", index, [])
+                                self.bytecodeInstructions.insert(index, Instruction("MINDEX"))
+                            inserted += 1
                             currentInstrs = []
 
                 if currentInstrs:
                     raise ValueError("Unkown or malformed instruction")
                 # remove the instructions left after merge
-                del self.bytecodeInstructions[index+1:index+1+length]
-                        
-        def update_stack(mnemonic, index, data):
-            for d in data:
-                self.bytecodeInstructions.insert(index, d)
-            if len(data) > 1:
-                mnemonic += "  /* %s values pushed */" % len(data)
-            self.bytecodeInstructions.insert(index, mnemonic)
+                del self.bytecodeInstructions[index+inserted:index+inserted+len(instr_list)]
 
         merge_PUSH()
         merge_SFVTCA()
         merge_OTHER()
 
-def save_font(bytecode, fontfile):
-    
-    font_roundtrip = TTFont(fontfile)
-    bytecodeContainer = BytecodeContainer(font_roundtrip)
-    for key in bytecode.keys():
-        # we don't want GS initialize instructions
-        if key == 'prep':
-            del bytecode[key][:17]
-        program_tag = key
-        instruction = constructInstructions(program_tag, bytecode[key])
-        bytecodeContainer.tag_to_programs[program_tag] = Program(instruction)
-    bytecodeContainer.updateTTFont(font_roundtrip)
-    roundtrip_filename = "{0}_roundtrip.ttf".format(fontfile.split(".ttf")[0])
-    font_roundtrip.save(roundtrip_filename)
-    font_roundtrip.close()
-
-def process_tables(tables):
-    bytecode = {} 
-    interpreter = InstructionInterpreter()
-    for tag in tables:
-        print("{0}:".format(tag))
-        for line in tables[tag]:
-            interpreter.parseInstruction(line.lstrip())
-        interpreter.merge()
-        bytecode[tag] = copy.deepcopy(interpreter.bytecodeInstructions)
-        interpreter.print_bytecode()
-        interpreter.clear()
+def assemble(instructions):
+    """
+    Returns the bytecode for instructions as merge() leaves them.
+    """
+    bytecode = array.array("B")
+    push = bytecode.append
+    for instr in instructions:
+        if type(instr) is not Instruction or instr.data is None:
+            raise ValueError("Unknown instruction %s" % instr)
+        if instr.mnemonic == "PUSH":
+            ttProgram.assemblePush(instr.data, push)
+            continue
+        if instr.mnemonic not in ttProgram.mnemonicDict:
+            raise ValueError("Unknown instruction %s" % instr)
+        op, argBits = ttProgram.mnemonicDict[instr.mnemonic]
+        if len(instr.data) != argBits:
+            raise ValueError("Incorrect number of argument bits (%s)" % instr)
+        if instr.data:
+            op += binary2num(instr.data)
+        push(op)
     return bytecode
 
+def compile_program(interpreter, tag):
+    """
+    Merges, prints and assembles what interpreter parsed for program
+    tag; returns its bytecode, and leaves interpreter empty.
+    """
+    print("{0}:".format(tag))
+    interpreter.merge()
+    interpreter.print_bytecode()
+    # we don't want GS initialize instructions
+    if tag == 'prep':
+        del interpreter.bytecodeInstructions[:17]
+    bytecode = assemble(interpreter.bytecodeInstructions)
+    interpreter.clear()
+    return bytecode
+
+def save_program(font, tag, bytecode):
+    if len(bytecode) == 0:
+        return
+    if tag.startswith("glyf."):
+        table = font['glyf'][tag[len("glyf."):]]
+    else:
+        table = font[tag]
+    if not hasattr(table, "program"):
+        table.program = ttProgram.Program()
+    table.program.fromBytecode(bytecode)
+
 def main(args):
+    """
+    Returns a dict mapping each program tag to its bytecode.
+    """
 
-    tags = {} 
     current_tag = ""
-    font_file = None
+    bytecode = {}
+    font = None
     if len(args) <= 0 or os.path.isfile(args[0]) == False:
         usage()
     if len(args) > 1:
-        font_file = args[1]
+        font = TTFont(args[1])
+
+    interpreter = InstructionInterpreter()
+    def end_program():
+        if current_tag != "":
+            bytecode[current_tag] = compile_program(interpreter, current_tag)
+            if font is not None:
+                save_program(font, current_tag, bytecode[current_tag])
 
     with open(args[0], "r") as file:
         
         for nl, line in enumerate(file):
             if line.isspace():
+                end_program()
                 current_tag = ""
             elif line.startswith('PREP:'):
+                end_program()
                 current_tag = 'prep'
-                tags['prep'] = []
             # we ignore function defs for now
             #elif line.startswith('Function'):
             #    current_tag = line[:-2] 
-            #    tags[current_tag] = []
             elif line.startswith('glyf'):
+                end_program()
                 current_tag = line[:-2]
-                tags[current_tag] = [] 
             elif current_tag != "":
-                tags[current_tag].append(line[:-1])
+                interpreter.parseInstruction(line[:-1].lstrip())
+        end_program()
 
-        bytecode = process_tables(tags)
-        if font_file:
-            save_font(bytecode, font_file)
-        return bytecode
+    if font is not None:
+        roundtrip_filename = "{0}_roundtrip.ttf".format(args[1].split(".ttf")[0])
+        font.save(roundtrip_filename)
+        font.close()
+    return bytecode
 
 if __name__ == '__main__':
   main(sys.argv[1:])
-
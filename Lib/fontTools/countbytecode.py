@@ -9,6 +9,7 @@ usage: pyftcount inputfile1 [... inputfileN]
     -h Help: print this message
     -y <number> Select font number for TrueType Collection,
        starting from 0.
+    -j N Jobs: count the inputfiles in N worker processes
 
 """
 
@@ -16,8 +17,13 @@ usage: pyftcount inputfile1 [... inputfileN]
 from __future__ import print_function, division, absolute_import
 from fontTools.misc.py23 import *
 from fontTools.ttLib import TTFont, TTLibError
+from fontTools.ttLib.tables._g_l_y_f import ARG_1_AND_2_ARE_WORDS, WE_HAVE_A_SCALE, \
+        WE_HAVE_AN_X_AND_Y_SCALE, WE_HAVE_A_TWO_BY_TWO, MORE_COMPONENTS, WE_HAVE_INSTRUCTIONS
 from fontTools.misc.macCreatorType import getMacCreatorAndType
+import array
+import multiprocessing
 import os
+import struct
 import sys
 import getopt
 import re
@@ -30,6 +36,7 @@ def usage():
 class Options(object):
     def __init__(self, rawOptions):
         self.fontNumber = -1
+        self.processes = 1
         for option, value in rawOptions:
             # general options
             if option == "-h":
@@ -38,6 +45,8 @@ class Options(object):
                 sys.exit(0)
             elif option == "-y":
                 self.fontNumber = int(value)
+            elif option == "-j":
+                self.processes = int(value)
 
 
 def yes_or_no(b):
@@ -47,32 +56,85 @@ def yes_or_no(b):
         return "no"
 
 
+def glyphInstructionLength(data, start, end):
+    '''
+    The instructionLength of the glyph in data[start:end] (raw glyf
+    bytes), read without decompiling or copying the glyph: it follows
+    the endPtsOfContours of simple glyphs, and the component records of
+    composite glyphs that have instructions.
+    '''
+    if end - start < 10:
+        return 0
+    numberOfContours = struct.unpack_from(">h", data, start)[0]
+    if numberOfContours >= 0:
+        i = start + 10 + 2 * numberOfContours
+    else:
+        i = start + 10
+        more = True
+        while more:
+            flags = struct.unpack_from(">H", data, i)[0]
+            i += 4
+            if flags & ARG_1_AND_2_ARE_WORDS: i += 4
+            else: i += 2
+            if flags & WE_HAVE_A_SCALE: i += 2
+            elif flags & WE_HAVE_AN_X_AND_Y_SCALE: i += 4
+            elif flags & WE_HAVE_A_TWO_BY_TWO: i += 8
+            more = flags & MORE_COMPONENTS
+        if not flags & WE_HAVE_INSTRUCTIONS:
+            return 0
+    if i + 2 > end:
+        return 0
+    return struct.unpack_from(">H", data, i)[0]
+
+
+def countGlyphPrograms(reader):
+    '''
+    (glyphs with instructions, glyphs) of the font read by reader (an
+    SFNTReader), scanning views of the raw loca and glyf tables.
+    '''
+    numGlyphs = struct.unpack_from(">H", reader.view('maxp'), 4)[0]
+    if 'glyf' not in reader.tables:
+        return 0, numGlyphs
+    indexToLocFormat = struct.unpack_from(">h", reader.view('head'), 50)[0]
+    offsets = array.array("I" if indexToLocFormat else "H")
+    loca = reader.view('loca')
+    offsets.fromstring(loca[:len(loca) - len(loca) % offsets.itemsize])
+    if sys.byteorder != "big":
+        offsets.byteswap()
+    if not indexToLocFormat:
+        offsets = array.array("I", [2 * offset for offset in offsets])
+    glyf = reader.view('glyf')
+    count = 0
+    for i in range(min(numGlyphs, len(offsets) - 1)):
+        start, end = offsets[i], min(offsets[i+1], len(glyf))
+        if end > start and glyphInstructionLength(glyf, start, end) > 0:
+            count += 1
+    return count, numGlyphs
+
+
 def ttCount(input, options):
+    '''the pyftcount line of input'''
     ttf = TTFont(input, fontNumber=options.fontNumber, lazy=True)
     reader = ttf.reader
     hasPrep = 'prep' in reader.tables
     hasFpgm = 'fpgm' in reader.tables
-    glyf_program_counts = 0
-    glyf_names = ttf.getGlyphSet().keys()
-    for glyf_name in glyf_names:
-        glyf = ttf['glyf'].glyphs[glyf_name]
-        glyf.expand(ttf['glyf'])
-        if hasattr(ttf['glyf'].glyphs[glyf_name], "program"):
-            prog = ttf['glyf'].glyphs[glyf_name].program
-            if (hasattr(prog, "bytecode") and len(prog.bytecode) > 0) or (hasattr(prog, "assembly") and len(prog.assembly) > 0):
-                glyf_program_counts += 1
-        #print ("%s %s" % (glyf, hasattr(ttf['glyf'].glyphs[glyf_name], "program")))
+    glyf_program_counts, numGlyphs = countGlyphPrograms(reader)
+    ttf.close()
     hasSomeGlyfCode = glyf_program_counts > 0
     globalAnswer = hasPrep or hasFpgm or hasSomeGlyfCode
-    print ("%s: %s, prep = %s, fpgm = %s, glyf = %s [%d/%d]" %
-           (input,
-            yes_or_no(globalAnswer),
-            yes_or_no(hasPrep),
-            yes_or_no(hasFpgm),
-            yes_or_no(hasSomeGlyfCode),
-            glyf_program_counts,
-            len(glyf_names)))
-    ttf.close()
+    return ("%s: %s, prep = %s, fpgm = %s, glyf = %s [%d/%d]" %
+            (input,
+             yes_or_no(globalAnswer),
+             yes_or_no(hasPrep),
+             yes_or_no(hasFpgm),
+             yes_or_no(hasSomeGlyfCode),
+             glyf_program_counts,
+             numGlyphs))
+
+
+def ttCountWorker(job):
+    input, options = job
+    return ttCount(input, options)
 
 
 def ttDump(input, output, options):
@@ -125,7 +187,7 @@ def guessFileType(fileName):
 
 def parseOptions(args):
     try:
-        rawOptions, files = getopt.getopt(args, "vy:")
+        rawOptions, files = getopt.getopt(args, "vy:j:")
     except getopt.GetoptError:
         usage()
 
@@ -152,8 +214,18 @@ def parseOptions(args):
 
 
 def process(jobs, options):
-    for input in jobs:
-        ttCount(input, options)
+    if options.processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(options.processes)
+        try:
+            # imap keeps the order of jobs and prints as results arrive
+            for line in pool.imap(ttCountWorker, [(input, options) for input in jobs]):
+                print(line)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for input in jobs:
+            print(ttCount(input, options))
 
 
 def waitForKeyPress():
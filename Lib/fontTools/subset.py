@@ -1325,7 +1325,7 @@ def prune_pre_subset(self, options):
 
 @_add_method(ttLib.getTableClass('glyf'))
 def subset_glyphs(self, s):
-  self.glyphs = dict((g,v) for g,v in self.glyphs.items() if g in s.glyphs)
+  self.glyphs = dict((g,self.glyphs[g]) for g in self.glyphs if g in s.glyphs)
   indices = [i for i,g in enumerate(self.glyphOrder) if g in s.glyphs]
   for v in self.glyphs.values():
     if hasattr(v, "data"):
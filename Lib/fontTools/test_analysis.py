@@ -1,6 +1,15 @@
 from fontTools import analysis
+from fontTools.analysisCache import AnalysisCache
+from fontTools.ttLib import TTFont, TTLibError
+from fontTools.ttLib.bytecodeContainer import BytecodeContainer
+from fontTools.ttLib.sfnt import TTCWriter
+from fontTools.ttLib.instructions import stackEffect, abstractExecute, concreteExecute, instructionConstructor
 from difflib import Differ
+import array
 import filecmp
+import json
+import os
+import shutil
 import sys
 import unittest
 import tempfile
@@ -36,6 +45,308 @@ class TestAnalysis(unittest.TestCase):
         self.regressionTest(["TestData/FreeMono-call-endf.ttx"], "TestData/empty.output")
     def test_subset_A(self):
         self.regressionTest(["-sc", "TestData/FreeMono-subset-A.ttx"], "TestData/FreeMono-subset-A-state-csv.output")
+    def test_inf_loop(self):
+        bc = BytecodeContainer(analysis.openFont("TestData/FreeMono-inf-loop.ttx"))
+        ae, called_functions = analysis.analysis(bc, analysis.allGlyphs(bc))
+        self.assertEqual(ae.errors, {})
+        self.assertEqual([str(s) for s in bc.IRs['fpgm_0']], ['$fpgm_0_1 := -1', 'JMPR fpgm.2'])
+        self.assertEqual(ae.maximum_stack_depth, 1)
+    def test_jrot_jrof(self):
+        bc = BytecodeContainer(analysis.openFont("TestData/FreeMono-jrot-jrof.ttx"))
+        ae, called_functions = analysis.analysis(bc, analysis.allGlyphs(bc))
+        self.assertEqual(ae.errors, {})
+        ir = "\n".join(str(s) for s in bc.IRs['fpgm_0'])
+        self.assertIn("JROT ($fpgm_0_2, fpgm.6)", ir)
+        self.assertIn("JROF ($fpgm_0_2, fpgm.10)", ir)
+        self.assertEqual(ae.maximum_stack_depth, 3)
+    def test_undefined_function(self):
+        bc = BytecodeContainer(analysis.openFont("TestData/FreeMono-empty-fdef.ttx"))
+        ae, called_functions = analysis.analysis(bc, analysis.allGlyphs(bc))
+        # only the glyph program calling the missing function is given up
+        self.assertEqual(ae.errors, {'glyf.A': "call to undefined function 13 at glyf.A.18"})
+        self.assertNotIn('glyf.A', bc.IRs)
+        self.assertIn('prep', bc.IRs)
+    def test_bad_jump(self):
+        tt = analysis.openFont("TestData/FreeMono-max.ttx")
+        tt['glyf']['A'].program.fromAssembly(['PUSH[ ]', '0', 'CALL[ ]', 'PUSH[ ]', '100', 'JMPR[ ]'])
+        for processes in (1, 2):
+            bc = BytecodeContainer(tt)
+            ae, called_functions = analysis.analysis(bc, ['glyf.A'], processes)
+            # the rest of the analysis goes on without glyf.A
+            self.assertEqual(ae.errors, {'glyf.A': "jump to position 103, outside of a body of 4 statements"})
+            self.assertNotIn('glyf.A', bc.IRs)
+            self.assertEqual(called_functions, set([0, 1]))
+        tt['glyf']['A'].program.fromAssembly(['MPPEM[ ]', 'JMPR[ ]'])
+        ae, called_functions = analysis.analysis(BytecodeContainer(tt), ['glyf.A'])
+        self.assertEqual(ae.errors, {'glyf.A': "jump by an unknown offset at glyf.A.1"})
+    def test_static_max_stack_depth(self):
+        bc = BytecodeContainer(analysis.openFont("TestData/FreeMono-max.ttx"))
+        glyphs = analysis.allGlyphs(bc)
+        ae, called_functions = analysis.analysis(bc, glyphs)
+        self.assertEqual(stackEffect.maximumStackDepth(bc, glyphs), ae.maximum_stack_depth)
+    def test_static_max_stack_depth_unsupported(self):
+        bc = BytecodeContainer(analysis.openFont("TestData/FreeMono-jrot-jrof.ttx"))
+        depthPass = stackEffect.StackDepthPass(bc)
+        with self.assertRaisesRegexp(stackEffect.StaticAnalysisUnsupported, "jumps"):
+            depthPass.run_body(bc.function_table[0].body, stackEffect.StackState([0]))
+        # the pass gives up on the jumps; abstract execution can tell
+        self.assertIsNone(stackEffect.maximumStackDepth(bc, analysis.allGlyphs(bc)))
+    def test_decode_bad_bytecode(self):
+        def decode(bytecode):
+            instructionConstructor.decodeBytecode("glyf.A", array.array("B", bytecode),
+                                                  array.array("i"))
+        # SVTCA[0], then an undefined opcode
+        with self.assertRaisesRegexp(TTLibError, "glyf.A: unknown opcode 0x28 at byte 1"):
+            decode([0x00, 0x28])
+        # NPUSHB of 3 bytes with only 2 left
+        with self.assertRaisesRegexp(TTLibError, "glyf.A: NPUSHB at byte 1 .* only 2 left"):
+            decode([0x00, 0x40, 3, 1, 2])
+        with self.assertRaisesRegexp(TTLibError, "glyf.A: NPUSHB at byte 0 has no count"):
+            decode([0x40])
+        # PUSHB[001] pushing 2 bytes, with 1 left
+        with self.assertRaisesRegexp(TTLibError, "glyf.A: PUSHB at byte 0 .* only 1 left"):
+            decode([0xb1, 7])
+    def test_concrete_operations(self):
+        binary = abstractExecute.concreteBinaryOperations
+        self.assertEqual(binary['SUB'](5, 3), 2)
+        self.assertEqual(binary['MUL'](-96, 128), -192)
+        self.assertEqual(binary['DIV'](-96, 128), -48)
+        self.assertEqual(binary['DIV'](1, 0), None)
+        self.assertEqual(binary['LT'](1, 2), 1)
+        self.assertEqual(abstractExecute.concreteUnaryOperations['ceil'](-65), -64)
+    def test_concrete_state(self):
+        # arithmetic on concrete operands shows its value in the state
+        # (-s); on symbolic ones, the expression
+        tt = analysis.openFont("TestData/FreeMono-max.ttx")
+        tt['prep'].program.fromAssembly(['PUSH[ ]', '0', 'CALL[ ]', 'PUSH[ ]', '2 3', 'ADD[ ]',
+                                         'MPPEM[ ]', 'PUSH[ ]', '1', 'ADD[ ]'])
+        bc = BytecodeContainer(tt)
+        ae, called_functions = analysis.analysis(bc, analysis.allGlyphs(bc))
+        self.assertTrue("program_stack = [5, $prep_3 ADD $prep_2]" in repr(ae.environment))
+    def test_simulate_ppems(self):
+        tt = analysis.openFont("TestData/FreeMono-max.ttx")
+        bc = BytecodeContainer(tt)
+        results = concreteExecute.simulate(bc, tt['head'].unitsPerEm, [12, 24],
+                                           analysis.allGlyphs(bc))
+        self.assertEqual([result["ppem"] for result in results], [12, 24])
+        self.assertEqual(results[0]["errors"], {})
+        self.assertEqual(results[1]["cvt"][3],
+                         concreteExecute.scaleFUnits(bc.cvt_table[3], 24, tt['head'].unitsPerEm))
+    def test_simulate_conditional_jump(self):
+        tt = analysis.openFont("TestData/FreeMono-max.ttx")
+        # below 10 ppem, JROT skips storage[1] := 1
+        tt['prep'].program.fromAssembly(['MPPEM[ ]', 'PUSH[ ]', '10', 'LT[ ]', 'PUSH[ ]', '3', 'JROT[ ]',
+                                         'PUSH[ ]', '1 1', 'WS[ ]', 'PUSH[ ]', '2 2', 'WS[ ]'])
+        bc = BytecodeContainer(tt)
+        results = concreteExecute.simulate(bc, tt['head'].unitsPerEm, [8, 20])
+        self.assertEqual([result["errors"] for result in results], [{}, {}])
+        self.assertEqual([result["storage"] for result in results], [{2: 2}, {1: 1, 2: 2}])
+    def test_simulate_loop_forever(self):
+        bc = BytecodeContainer(analysis.openFont("TestData/FreeMono-inf-loop.ttx"))
+        results = concreteExecute.simulate(bc, 1000, [12])
+        self.assertEqual(results[0]["errors"], {
+            'prep': "prep: more than %d instructions executed" % concreteExecute.ConcreteState.MAX_STEPS})
+    def test_call_graph(self):
+        bc = BytecodeContainer(analysis.openFont("TestData/FreeMono-max.ttx"))
+        glyphs = analysis.allGlyphs(bc)
+        ae, called_functions = analysis.analysis(bc, glyphs)
+        graph = analysis.callGraph(ae, glyphs)
+        self.assertEqual(graph["calls"], {"prep": {"0": 1}, "fpgm_0": {"1": 1}})
+        self.assertEqual(graph["reached_by"], {"0": ["prep"], "1": ["prep"]})
+    def test_profile(self):
+        bc = BytecodeContainer(analysis.openFont("TestData/FreeMono-max.ttx"))
+        profile = abstractExecute.InstructionProfile()
+        analysis.analysis(bc, analysis.allGlyphs(bc), profile=profile)
+        flat = profile.flat()
+        self.assertEqual(flat["prep"][0], sum(count for stack, count in profile.counts.items()
+                                              if stack[0] == "prep"))
+        self.assertTrue(flat["fpgm_0"][0] >= flat["fpgm_1"][0] > 0)
+        self.assertEqual(flat["fpgm_1"][0], flat["fpgm_1"][1])
+    def test_compact_function_hash(self):
+        tt = analysis.openFont("TestData/FreeMono-max.ttx")
+        hashes = []
+        for compact in (True, False):
+            bc = BytecodeContainer(tt, compact=compact)
+            cache = AnalysisCache(tempfile.mktemp(), tt, bc)
+            hashes.append(cache.calleeHashes(bc.function_table.keys()))
+            if compact:
+                # hashing doesn't make the statements of compact functions
+                self.assertFalse(any('instructions' in function.body.__dict__
+                                     for function in bc.function_table.values()))
+        self.assertEqual(hashes[0], hashes[1])
+    def test_batch(self):
+        tf = tempfile.NamedTemporaryFile()
+        analysis.main(["--batch", tf.name, "TestData/FreeMono-max.ttx"])
+        result = json.loads(tf.read())
+        tf.close()
+        self.assertEqual(result["max_stack_depth"], 2)
+        self.assertEqual(result["unused_functions"], [])
+    def test_batch_collection(self):
+        font = tempfile.NamedTemporaryFile(suffix=".ttf")
+        analysis.openFont("TestData/FreeMono-max.ttx").save(font.name)
+        reader = analysis.openFont(font.name).reader
+        tables = dict((tag, reader[tag]) for tag in reader.keys())
+        collection = tempfile.NamedTemporaryFile(suffix=".ttc")
+        writer = TTCWriter(collection)
+        writer.addFont(tables)
+        writer.addFont(tables)
+        writer.close()
+        collection.flush()
+        font.close()
+        tf = tempfile.NamedTemporaryFile()
+        analysis.main(["--batch", tf.name, collection.name])
+        results = [json.loads(line) for line in tf]
+        tf.close()
+        collection.close()
+        self.assertEqual(sorted(result["font_number"] for result in results), [0, 1])
+        self.assertEqual([result["max_stack_depth"] for result in results], [2, 2])
+    def test_save_to_own_path(self):
+        font = tempfile.NamedTemporaryFile(suffix=".ttf")
+        analysis.openFont("TestData/FreeMono-max.ttx").save(font.name)
+        tt = TTFont(font.name)
+        tt['name'].names[0].string = "edited"
+        other = tempfile.NamedTemporaryFile(suffix=".ttf")
+        tt.save(other.name)
+        # overwrites the file tt is mapped from
+        tt.save(font.name)
+        tt.close()
+        saved, expected = TTFont(font.name), TTFont(other.name)
+        for tag in expected.keys():
+            if tag not in ('GlyphOrder', 'head'):
+                self.assertEqual(saved.getTableData(tag), expected.getTableData(tag))
+        font.close()
+        other.close()
+    def test_reuse_unmodified(self):
+        font = tempfile.NamedTemporaryFile(suffix=".ttf")
+        analysis.openFont("TestData/FreeMono-max.ttx").save(font.name)
+        tt = TTFont(font.name)
+        tt['maxp'].dirty = False
+        def compile(ttFont):
+            raise AssertionError("compiled an unmodified table")
+        tt['maxp'].compile = compile
+        tt['name'].dirty = False
+        tt['name'].names[0].string = "edited"
+        tt['name'].dirty = True
+        saved = tempfile.NamedTemporaryFile(suffix=".ttf")
+        tt.save(saved.name, reuseUnmodified=True)
+        tt.close()
+        original, result = TTFont(font.name), TTFont(saved.name)
+        self.assertEqual(result.reader['maxp'], original.reader['maxp'])
+        self.assertEqual(result['name'].names[0].string, "edited")
+        saved.close()
+        font.close()
+    def test_reduce_reuses_unmodified(self):
+        tt = analysis.openFont("TestData/FreeMono-max.ttx")
+        # an uncalled function for -r to remove
+        tt['fpgm'].program.fromAssembly(tt['fpgm'].program.getAssembly() +
+                                        ['PUSH[ ]', '2', 'FDEF[ ]', 'PUSH[ ]', '5', 'POP[ ]', 'ENDF[ ]'])
+        directory = tempfile.mkdtemp()
+        tt.save(os.path.join(directory, "font.ttf"))
+        analysis.main(["-r", os.path.join(directory, "font.ttf")])
+        original = TTFont(os.path.join(directory, "font.ttf"))
+        reduced = TTFont(os.path.join(directory, "Reducedfont.ttf"))
+        self.assertEqual(sorted(BytecodeContainer(reduced).function_table.keys()), [0, 1])
+        for tag in ('prep', 'cvt ', 'glyf', 'loca'):
+            self.assertEqual(reduced.reader[tag], original.reader[tag])
+        original.close()
+        reduced.close()
+        shutil.rmtree(directory)
+    def test_reduce_collection(self):
+        directory = tempfile.mkdtemp()
+        tt = analysis.openFont("TestData/FreeMono-max.ttx")
+        # an uncalled function for -r to remove
+        tt['fpgm'].program.fromAssembly(tt['fpgm'].program.getAssembly() +
+                                        ['PUSH[ ]', '2', 'FDEF[ ]', 'PUSH[ ]', '5', 'POP[ ]', 'ENDF[ ]'])
+        tt.save(os.path.join(directory, "max.ttf"))
+        analysis.openFont("TestData/FreeMono-jrot-jrof.ttx").save(os.path.join(directory, "jrot.ttf"))
+        writer = TTCWriter(open(os.path.join(directory, "fonts.ttc"), "wb"))
+        for name in ("max.ttf", "jrot.ttf", "max.ttf"):
+            reader = TTFont(os.path.join(directory, name)).reader
+            writer.addFont(dict((tag, reader[tag]) for tag in reader.keys()))
+        writer.close()
+        writer.file.close()
+        analysis.main(["-r", os.path.join(directory, "fonts.ttc")])
+        functions = []
+        for fontNumber in range(3):
+            reduced = TTFont(os.path.join(directory, "Reducedfonts.ttc"), fontNumber=fontNumber)
+            for tag in reduced.keys():
+                reduced[tag]
+            functions.append(sorted(BytecodeContainer(reduced).function_table.keys()))
+            reduced.close()
+        self.assertEqual(functions, [[0, 1], [0], [0, 1]])
+        shutil.rmtree(directory)
+    def test_collection_needs_reduce(self):
+        stderr = sys.stderr
+        sys.stderr = tempfile.TemporaryFile()
+        try:
+            with self.assertRaises(SystemExit):
+                analysis.main(["-i", "fonts.ttc"])
+            sys.stderr.seek(0)
+            self.assertIn("font collections can only be reduced (-r)", sys.stderr.read())
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+    def test_lazy_glyphs(self):
+        path = "TestData/FreeMono-bad-interpretation.ttf"
+        lazy, eager = TTFont(path, lazy=True), TTFont(path, lazy=False)
+        lazyGlyf, eagerGlyf = lazy['glyf'], eager['glyf']
+        # a lookup only makes the glyph looked up
+        lazyGlyf['A']
+        self.assertEqual(list(lazyGlyf.glyphs.glyphs), ['A'])
+        self.assertEqual(sorted(lazyGlyf.keys()), sorted(eagerGlyf.keys()))
+        for glyphName in eager.getGlyphOrder():
+            lazyGlyph, eagerGlyph = lazyGlyf[glyphName], eagerGlyf[glyphName]
+            lazyGlyph.expand(lazyGlyf)
+            lazyAttributes, eagerAttributes = dict(vars(lazyGlyph)), dict(vars(eagerGlyph))
+            if 'program' in eagerAttributes:
+                self.assertEqual(lazyAttributes.pop('program').getBytecode(),
+                                 eagerAttributes.pop('program').getBytecode())
+            self.assertEqual(lazyAttributes, eagerAttributes)
+        self.assertEqual(lazyGlyf.compile(lazy), eagerGlyf.compile(eager))
+        self.assertEqual(lazy['loca'].compile(lazy), eager['loca'].compile(eager))
+    def test_subset_lazy_glyphs(self):
+        from fontTools import subset
+        tt = TTFont("TestData/FreeMono-bad-interpretation.ttf", lazy=True)
+        glyphs = tt['glyf'].glyphs
+        class Subsetter(object):
+            pass
+        subsetter = Subsetter()
+        subsetter.glyphs = set(['A'])
+        tt['glyf'].subset_glyphs(subsetter)
+        # only the glyph kept was made
+        self.assertEqual(list(glyphs.glyphs), ['A'])
+        self.assertEqual(tt['glyf'].keys(), ['A'])
+    def test_save_in_parallel(self):
+        tt = TTFont(recalcTimestamp=False)
+        tt.importXML("TestData/FreeMono-max.ttx", quiet=True)
+        serial, parallel = tempfile.TemporaryFile(), tempfile.TemporaryFile()
+        tt.save(serial)
+        # cmap, name and post are compiled by the workers
+        tt.save(parallel, processes=2)
+        serial.seek(0)
+        parallel.seek(0)
+        self.assertEqual(parallel.read(), serial.read())
+        serial.close()
+        parallel.close()
+    def test_hmtx_metrics(self):
+        font = tempfile.NamedTemporaryFile(suffix=".ttf")
+        analysis.openFont("TestData/FreeMono-max.ttx").save(font.name)
+        tt = TTFont(font.name)
+        hmtx = tt['hmtx']
+        self.assertEqual(hmtx.compile(tt), tt.reader['hmtx'])
+        # as the dict of lists fromXML makes
+        metrics = hmtx.metrics
+        hmtx.metrics = dict((name, list(metrics[name])) for name in metrics)
+        self.assertEqual(hmtx.compile(tt), tt.reader['hmtx'])
+        hmtx.metrics = metrics
+        hmtx.dirty = False
+        hmtx.metrics['A'][0] = 700
+        self.assertTrue(hmtx.dirty)
+        self.assertEqual(hmtx['A'], [700, metrics['A'][1]])
+        tt.save(font.name)
+        tt.close()
+        self.assertEqual(TTFont(font.name)['hmtx']['A'][0], 700)
+        font.close()
 
 if __name__ == '__main__':
     unittest.main()
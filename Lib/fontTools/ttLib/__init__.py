@@ -173,25 +173,38 @@ class TTFont(object):
 		if self.reader is not None:
 			self.reader.close()
 	
-	def save(self, file, makeSuitcase=False, reorderTables=True):
+	def save(self, file, makeSuitcase=False, reorderTables=True, processes=1,
+			reuseUnmodified=False):
 		"""Save the font to disk. Similarly to the constructor, 
 		the 'file' argument can be either a pathname or a writable
 		file object.
 		
 		On the Mac, if makeSuitcase is true, a suitcase (resource fork)
 		file will we made instead of a flat .ttf file. 
+
+		If processes is more than 1, the loaded tables listed in
+		parallelTables are compiled concurrently, in that many worker
+		processes. Whatever their compile() changes in the tables
+		themselves is then not seen by this TTFont.
+
+		If reuseUnmodified is true, the loaded tables the caller marked
+		unchanged by clearing their 'dirty' flag (see DefaultTable), and
+		that don't depend on dirty tables, are copied from the font file
+		instead of being compiled, as the tables that weren't loaded are.
+		Tables decompiled from the file stay dirty until then.
 		"""
 		from fontTools.ttLib import sfnt
+		path = None
 		if not hasattr(file, "write"):
 			closeStream = 1
 			if os.name == "mac" and makeSuitcase:
 				from . import macUtils
 				file = macUtils.SFNTResourceWriter(file, self)
 			else:
-				file = open(file, "wb")
-				if os.name == "mac":
-					from fontTools.misc.macCreator import setMacCreatorAndType
-					setMacCreatorAndType(file.name, 'mdos', 'BINA')
+				# opened once the font is written out, in case it is
+				# the file the font is read from
+				path = file
+				file = None
 		else:
 			# assume "file" is a writable file object
 			closeStream = 0
@@ -200,24 +213,42 @@ class TTFont(object):
 		if "GlyphOrder" in tags:
 			tags.remove("GlyphOrder")
 		numTables = len(tags)
-		if reorderTables:
+		if reorderTables or path is not None:
 			import tempfile
 			tmp = tempfile.TemporaryFile(prefix="ttx-fonttools")
 		else:
 			tmp = file
 		writer = sfnt.SFNTWriter(tmp, numTables, self.sfntVersion, self.flavor, self.flavorData)
 		
+		compiled = {}
+		if reuseUnmodified:
+			compiled.update(self._unmodifiedTableData(tags))
+		if processes > 1:
+			compiled.update(self._compileTablesInParallel(tags, processes, compiled))
 		done = []
 		for tag in tags:
-			self._writeTable(tag, writer, done)
+			self._writeTable(tag, writer, done, compiled)
 		
 		writer.close()
 
+		if path is not None:
+			# everything the font needed from its file has been read
+			if self.reader is not None:
+				self.reader.unmap()
+			file = open(path, "wb")
+			if os.name == "mac":
+				from fontTools.misc.macCreator import setMacCreatorAndType
+				setMacCreatorAndType(file.name, 'mdos', 'BINA')
+
 		if reorderTables:
 			tmp.flush()
 			tmp.seek(0)
 			reorderFontTables(tmp, file)
 			tmp.close()
+		elif tmp is not file:
+			tmp.seek(0)
+			file.write(tmp.read())
+			tmp.close()
 
 		if closeStream:
 			file.close()
@@ -448,6 +479,8 @@ class TTFont(object):
 				self.glyphOrder = glyphOrder
 		else:
 			self._getGlyphNamesFromCmap()
+		# to tell whether it changed since (see save())
+		self._loadedGlyphOrder = list(self.glyphOrder)
 		return self.glyphOrder
 	
 	def _getGlyphNamesFromCmap(self):
@@ -609,9 +642,10 @@ class TTFont(object):
 		for glyphID in range(len(glyphOrder)):
 			d[glyphOrder[glyphID]] = glyphID
 	
-	def _writeTable(self, tag, writer, done):
+	def _writeTable(self, tag, writer, done, compiled=None):
 		"""Internal helper function for self.save(). Keeps track of 
-		inter-table dependencies.
+		inter-table dependencies. Tables in compiled (a dict of tag ->
+		data) were compiled already.
 		"""
 		if tag in done:
 			return
@@ -619,15 +653,75 @@ class TTFont(object):
 		for masterTable in tableClass.dependencies:
 			if masterTable not in done:
 				if masterTable in self:
-					self._writeTable(masterTable, writer, done)
+					self._writeTable(masterTable, writer, done, compiled)
 				else:
 					done.append(masterTable)
-		tabledata = self.getTableData(tag)
+		if compiled is not None and tag in compiled:
+			tabledata = compiled[tag]
+		else:
+			tabledata = self.getTableData(tag)
 		if self.verbose:
 			debugmsg("writing '%s' table to disk" % tag)
 		writer[tag] = tabledata
 		done.append(tag)
 	
+	def _unmodifiedTableData(self, tags):
+		"""Internal helper function for self.save(). Returns the data in
+		the font file of the loaded tables of tags that can be saved as
+		they were read, as a dict of tag -> data.
+		"""
+		if self.reader is None:
+			return {}
+		if hasattr(self, "glyphOrder") and self.glyphOrder != getattr(self, "_loadedGlyphOrder", None):
+			# the tables indexed by glyph ID would have to be compiled
+			return {}
+		modified = {}
+		def isModified(tag):
+			if tag not in modified:
+				if not self.isLoaded(tag):
+					modified[tag] = tag not in self.reader
+				else:
+					modified[tag] = self.tables[tag].dirty or tag not in self.reader or any(
+							isModified(masterTable) for masterTable in getTableClass(tag).dependencies
+							if masterTable in self)
+			return modified[tag]
+		loaded = [tag for tag in tags if self.isLoaded(tag)]
+		if self.recalcTimestamp and 'head' in loaded and any(isModified(tag) for tag in tags):
+			# compiling head updates its modification time
+			modified['head'] = True
+		return dict((tag, self.reader[tag]) for tag in loaded if not isModified(tag))
+	
+	def _compileTablesInParallel(self, tags, processes, compiled):
+		"""Internal helper function for self.save(). Returns the data of
+		the tables of tags that aren't in compiled already, as a dict of
+		tag -> data, compiling the independent ones in worker processes.
+		Returns an empty dict if there are too few of these to be worth
+		it.
+		"""
+		dependedOn = set()
+		for tag in tags:
+			dependedOn.update(getTableClass(tag).dependencies)
+		parallel = [tag for tag in tags
+				if tag in parallelTables and tag not in dependedOn and self.isLoaded(tag) and
+				tag not in compiled]
+		if len(parallel) < 2 or not hasattr(os, "fork"):
+			return {}
+		# The other tables first, in dependency order: compiling them can
+		# change what the parallel ones read (glyf sets maxp.numGlyphs,
+		# which post reads). The workers are forked after that.
+		result = {}
+		done = parallel + list(compiled.keys())
+		for tag in tags:
+			self._writeTable(tag, result, done)
+		import multiprocessing
+		pool = multiprocessing.Pool(min(processes, len(parallel)), _initCompileWorker, (self,))
+		try:
+			result.update(zip(parallel, pool.map(_compileTable, parallel)))
+		finally:
+			pool.close()
+			pool.join()
+		return result
+	
 	def getTableData(self, tag):
 		"""Returns raw table data, whether compiled or directly read from disk.
 		"""
@@ -664,6 +758,24 @@ class TTFont(object):
 		raise TTLibError("Font contains no outlines")
 
 
+# Tables no other table depends on, whose compile() only reads the rest
+# of the font: TTFont.save() can compile them in worker processes.
+parallelTables = frozenset(["GSUB", "GPOS", "GDEF", "BASE", "JSTF", "CFF ",
+		"cmap", "name", "post", "kern"])
+
+# the TTFont whose tables _compileTable compiles, in the worker processes
+# of TTFont._compileTablesInParallel(); handed to each worker once, at
+# startup
+_compileWorkerFont = None
+
+def _initCompileWorker(font):
+	global _compileWorkerFont
+	_compileWorkerFont = font
+
+def _compileTable(tag):
+	return _compileWorkerFont.getTableData(tag)
+
+
 class _TTGlyphSet(object):
 	
 	"""Generic dict-like GlyphSet class, meant as a TrueType counterpart
@@ -1,10 +1,21 @@
-from instructions import statements, instructionConstructor, abstractExecute
+from instructions import statements, instructionConstructor, abstractExecute, stackEffect
+from fontTools.ttLib.tables import ttProgram
+import array
 
 class BytecodeContainer(object):
-    """ Represents bytecode-related global data for a TrueType font. """
-    def __init__(self, tt):
-        # tag id -> Program
-        self.tag_to_programs = {}
+    """
+    Represents bytecode-related global data for a TrueType font.
+
+    With compact=True, programs and functions are kept in compact form
+    (see instructionConstructor.decodeBytecode) and only get statements
+    once something walks them, e.g. when they are executed.
+    """
+    def __init__(self, tt, compact=False):
+        self.compact = compact
+        # the values pushed by all compact programs
+        self.operands = array.array("i")
+        # tag id -> Program, see ProgramTable
+        self.tag_to_programs = None
         self.IRs = {}
         # function_table: function label -> Function
         self.function_table = {}
@@ -25,44 +36,23 @@ class BytecodeContainer(object):
     def extractProgram(self, tt):
         '''
         a dictionary maps tag->Program to extract all the bytecodes
-        in a single font file
+        in a single font file; glyph programs are only extracted
+        once they are asked for
         '''
-        def constructInstructions(program_tag, instructions):
-            thisinstruction = None
-            instructions_list = []
-            def combineInstructionData(instruction,data):
-                instruction.add_data(data)
-            number = 0
-            for instruction in instructions:
-                instructionCons = instructionConstructor.instructionConstructor(instruction)
-                instruction = instructionCons.getClass()
-        
-                if isinstance(instruction, instructionConstructor.Data):
-                    combineInstructionData(thisinstruction,instruction)
-                else:
-                    if thisinstruction is not None:
-                        thisinstruction.id = program_tag + '.' + str(number)
-                        instructions_list.append(thisinstruction)
-                        number = number+1
-                    thisinstruction = instruction
-
-            instructions_list.append(thisinstruction)
-            return instructions_list
-        
-        def add_tags_with_bytecode(tt,tag):
-            for key in tt.keys():
-                if hasattr(tt[key], 'program'):
-                    if len(tag) != 0:
-                        program_tag = tag+"."+key
-                    else:
-                        program_tag = key
-                    self.tag_to_programs[program_tag] = constructInstructions(program_tag, tt[key].program.getAssembly())
-                if hasattr(tt[key], 'keys'):
-                    add_tags_with_bytecode(tt[key],tag+key)
+        # only fpgm, prep and the glyph programs carry bytecode; don't
+        # walk (and so decompile) any other table of the font
+        def add_tags_with_bytecode(tt):
+            glyf = None
+            if 'glyf' in tt:
+                glyf = tt['glyf']
+            self.tag_to_programs = ProgramTable(self, glyf)
+            for key in ['fpgm', 'prep']:
+                if key in tt and hasattr(tt[key], 'program'):
+                    self.tag_to_programs[key] = self.constructInstructions(key, tt[key].program)
 
         # preprocess the function definition instructions between <fpgm></fpgm>
         def extract_functions():
-            if('fpgm' in self.tag_to_programs.keys()):
+            if('fpgm' in self.tag_to_programs):
                 instructions = self.tag_to_programs['fpgm']
                 functionsLabels = []
                 skip = False
@@ -86,16 +76,60 @@ class BytecodeContainer(object):
                 for key, value in self.function_table.items():
                     value.constructBody()
 
+        # the same, on the opcodes of a compact fpgm
+        def extract_compact_functions():
+            if('fpgm' in self.tag_to_programs):
+                instructions = self.tag_to_programs['fpgm']
+                functionsLabels = []
+                skip = False
+                start = None
+                for index in range(len(instructions)):
+                    opcode = instructions.opcode(index)
+                    if not skip:
+                        if opcode == instructionConstructor.PUSH_OPCODE:
+                            functionsLabels.extend(instructions.values(index))
+                        if opcode == FDEF_OPCODE:
+                            skip = True
+                            start = index + 1
+                    elif opcode == ENDF_OPCODE:
+                        skip = False
+                        function_label = functionsLabels.pop()
+                        body = Body(compact = instructions.slice(start, index))
+                        self.function_table[function_label] = Function(body = body)
+
         # transform list of instructions -> Program
         def setup_programs():
-            for key, instr in self.tag_to_programs.items():
-                if key is not 'fpgm':
-                    self.tag_to_programs[key] = Program(instr)
-
-        add_tags_with_bytecode(tt,"")
-        extract_functions()
+            for key in ['fpgm', 'prep']:
+                if key in self.tag_to_programs:
+                    instr = self.tag_to_programs[key]
+                    if self.compact:
+                        self.tag_to_programs[key] = Program(body = Body(compact = instr))
+                    elif key is not 'fpgm':
+                        self.tag_to_programs[key] = Program(instr)
+
+        add_tags_with_bytecode(tt)
+        if self.compact:
+            extract_compact_functions()
+        else:
+            extract_functions()
         setup_programs()
 
+    def constructInstructions(self, program_tag, program):
+        if not hasattr(program, "bytecode"):
+            program.getBytecode()
+        if self.compact:
+            opcodes, offsets = instructionConstructor.decodeBytecode(program_tag, program.bytecode,
+                                                                     self.operands)
+            return instructionConstructor.CompactInstructions(program_tag, opcodes, offsets,
+                                                              self.operands)
+        return instructionConstructor.constructInstructionsFromBytecode(program_tag, program.bytecode)
+
+    def constructProgram(self, program_tag, program):
+        instr = self.constructInstructions(program_tag, program)
+        if self.compact:
+            return Program(body = Body(compact = instr))
+        return Program(instr)
+
     #remove functionsToRemove from the function table
     def removeFunctions(self, functionsToRemove=[]):
         for label in functionsToRemove:
@@ -128,94 +162,141 @@ class BytecodeContainer(object):
             for old_label, line in function_calls[table]:
                 root.data[line-1] = self.label_mapping[old_label]
 
-    #update the TTFont object passed with contets of current BytecodeContainer
+    #update the TTFont object passed with contets of current BytecodeContainer;
+    #only the tables that change are marked dirty
     def updateTTFont(self, ttFont):
         self.replaceCVTTable(ttFont)
         self.replaceFpgm(ttFont)
         self.replaceOtherTables(ttFont)
  
     def replaceCVTTable(self, ttFont):
+        cvt = ttFont['cvt ']
         for i in range(len(self.cvt_table)):
-            ttFont['cvt '].values[i] = self.cvt_table[i]
-
-    def instrToAssembly(self, instr):
-        assembly = []
-        if(instr.mnemonic == 'PUSH'):
-            assembly.append('PUSH[ ]')
-            if(len(instr.data) > 1):
-                assembly[-1] += "  /* %s values pushed */" % len(instr.data)
-
-            for data in instr.data:
-                assembly.append(str(data))
-        else:
-            if(len(instr.data) > 0):
-                instr_append = instr.mnemonic+'['
-                for data in instr.data:
-                    instr_append += str(data)
-                instr_append += ']'
-                assembly.append(instr_append)
-            else:
-                assembly.append(instr.mnemonic+'[ ]')
-        return assembly
+            if cvt.values[i] != self.cvt_table[i]:
+                cvt.values[i] = self.cvt_table[i]
+                cvt.dirty = True
 
     # replaces the Fpgm in ttFont with contents of this;
     # rebuilds the function number mass-PUSH and includes FDEFs
     def replaceFpgm(self, ttFont):
-        assembly = []
-        skip = False
-
         if len(self.function_table) > 0:
-            assembly.append("PUSH[ ]")
-            if(len(self.function_table) > 1):
-                assembly[-1] += "  /* %s values pushed */" % len(self.function_table)
-
-            for label in reversed(self.function_table.keys()):
-                assembly.append(str(label))
-
+            bytecode = array.array("B")
+            push = bytecode.append
+            labels = list(reversed(self.function_table.keys()))
+            ttProgram.assemblePush(labels, push)
             for function in self.function_table.values():
-                assembly.append('FDEF[ ]')
-                for instr in function.instructions:
-                    assembly.extend(self.instrToAssembly(instr))
-
-                assembly.append('ENDF[ ]')
-            ttFont['fpgm'].program.fromAssembly(assembly)
+                push(FDEF_OPCODE)
+                function.assemble(push)
+                push(ENDF_OPCODE)
+            fpgm = ttFont['fpgm']
+            if bytecode.tostring() != fpgm.program.getBytecode():
+                fpgm.program.fromBytecode(bytecode)
+                fpgm.dirty = True
 
     def replaceOtherTables(self, ttFont):
         for table in self.tag_to_programs.keys():
-            assembly = []
-            if table != 'fpgm':
-                root = self.tag_to_programs[table].body.statement_root
-                if root is not None:
-                    
-                    stack = []
-                    stack.append(root)
-
-                    while len(stack) > 0:
-                        top_instr = stack[-1]
-                        assembly.extend(self.instrToAssembly(top_instr))
-                        stack.pop()
-
-                        if len(top_instr.successors) > 1:
-                            reverse_successor = top_instr.successors[::-1]
-                            stack.extend(reverse_successor)
-                        else:
-                            stack.extend(top_instr.successors)
-                if len(assembly) > 0:
-                    try:
-                        ttFont[table].program.fromAssembly(assembly)
-                    except:
-                        table = table.replace("glyf.", "")
-                        ttFont['glyf'].glyphs[table].program.fromAssembly(assembly)
+            if table == 'fpgm':
+                continue
+            bytecode = array.array("B")
+            self.tag_to_programs[table].body.assemble(bytecode.append)
+            if len(bytecode) > 0:
+                if table.startswith("glyf."):
+                    program = ttFont['glyf'].glyphs[table[len("glyf."):]].program
+                    changed = ttFont['glyf']
+                else:
+                    program = ttFont[table].program
+                    changed = ttFont[table]
+                if bytecode.tostring() != program.getBytecode():
+                    program.fromBytecode(bytecode)
+                    changed.dirty = True
 
     def print_IR(self, IR):
         for line in IR:
             print line
 
+class ProgramTable(object):
+    '''
+    Maps tags to Programs like a dict, but only extracts a glyph's
+    program the first time that glyph is looked up. Listing the tags
+    (keys(), items(), iterating...) extracts all of them.
+    '''
+    def __init__(self, bytecodeContainer, glyf=None):
+        self.bytecodeContainer = bytecodeContainer
+        self.glyf = glyf
+        self.programs = {}
+        self.loaded_all = glyf is None
+
+    def load(self, tag):
+        if tag in self.programs:
+            return True
+        if self.loaded_all or not tag.startswith('glyf.'):
+            return False
+        glyph_name = tag[len('glyf.'):]
+        if glyph_name not in self.glyf:
+            return False
+        glyph = self.glyf[glyph_name]
+        if not hasattr(glyph, 'program'):
+            return False
+        self.programs[tag] = self.bytecodeContainer.constructProgram(tag, glyph.program)
+        return True
+
+    def loadAll(self):
+        if not self.loaded_all:
+            for glyph_name in self.glyf.keys():
+                self.load("glyf." + glyph_name)
+            self.loaded_all = True
+
+    def __getitem__(self, tag):
+        if not self.load(tag):
+            raise KeyError(tag)
+        return self.programs[tag]
+
+    def __setitem__(self, tag, program):
+        self.programs[tag] = program
+
+    def __delitem__(self, tag):
+        self.loadAll()
+        del self.programs[tag]
+
+    def __contains__(self, tag):
+        return self.load(tag)
+
+    has_key = __contains__
+
+    def get(self, tag, default=None):
+        if not self.load(tag):
+            return default
+        return self.programs[tag]
+
+    def keys(self):
+        self.loadAll()
+        return self.programs.keys()
+
+    def values(self):
+        self.loadAll()
+        return self.programs.values()
+
+    def items(self):
+        self.loadAll()
+        return self.programs.items()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        self.loadAll()
+        return len(self.programs)
+
+FDEF_OPCODE = statements.all.FDEF_Statement().opcode
+ENDF_OPCODE = statements.all.ENDF_Statement().opcode
+
 # Function and Program are suspiciously similar; should probably be refactored.
 # per-glyph instructions
 class Program(object):
-    def __init__(self, input):
-        self.body = Body(instructions = input)
+    def __init__(self, input=None, body=None):
+        if body is None:
+            body = Body(instructions = input)
+        self.body = body
         self.call_function_set = [] # set of functions called in the tag program
     def pretty_print(self):
         self.body.pretty_print()
@@ -223,20 +304,44 @@ class Program(object):
         return self.body.statement_root
 
 class Function(object):
-    def __init__(self, instructions=None):
-        self.instructions = []
+    def __init__(self, instructions=None, body=None):
+        if body is None:
+            self.instructions = []
+        else:
+            self.body = body
+    def __getattr__(self, name):
+        # a function with a compact body has the body's statements
+        if name != 'instructions' or 'body' not in self.__dict__:
+            raise AttributeError(name)
+        return self.body.instructions
     def pretty_print(self):
         self.body.pretty_print()
     def constructBody(self):
         self.body = Body(instructions = self.instructions)
+    def assemble(self, push):
+        if 'instructions' in self.__dict__:
+            instructionConstructor.assembleStatements(self.instructions, push)
+        else:
+            self.body.assemble(push)
     def start(self):
         return self.body.statement_root
 
 class Body(object):
     '''
     Encapsulates a list of statements.
+
+    A body made from compact instructions (compact=...) only makes its
+    statements, and their CFG, when instructions or statement_root is
+    first asked for.
     '''
     def __init__(self,*args, **kwargs):
+        self.has_jumps = False
+        self.positions = None
+        self.stack_summary = None
+        if kwargs.get('compact') is not None:
+            self.compact = kwargs.get('compact')
+            self.has_jumps = self.compact.hasJumps()
+            return
         self.statement_root = None
         if kwargs.get('statement_root') is not None:
             self.statement_root = kwargs.get('statement_root')
@@ -245,6 +350,18 @@ class Body(object):
             if len(self.instructions) > 0:
                 self.statement_root = self.constructSuccessorAndPredecessor()
     
+    def __getattr__(self, name):
+        if name not in ('instructions', 'statement_root') or 'compact' not in self.__dict__:
+            raise AttributeError(name)
+        self.constructStatements()
+        return self.__dict__[name]
+
+    def constructStatements(self):
+        self.instructions = self.compact.statements()
+        self.statement_root = None
+        if len(self.instructions) > 0:
+            self.statement_root = self.constructSuccessorAndPredecessor()
+
     # CFG construction
     def constructSuccessorAndPredecessor(self):
         def is_branch(instruction):
@@ -259,15 +376,13 @@ class Body(object):
             this_instruction = self.instructions[index]
 
             # Jump instructions are sporadically used.
-            # We'll just treat them like normal statements now and fix up the
-            # CFG during symbolic execution, since we need to read the dest off the stack.
-
-            #if isinstance(this_instruction,statements.all.JMPR_Statement):
-            #    raise NotImplementedError
-            #elif isinstance(this_instruction,statements.all.JROT_Statement):
-            #    raise NotImplementedError
-            #elif isinstance(this_instruction,statements.all.JROF_Statement):
-            #    raise NotImplementedError
+            # We'll just treat them like normal statements here; the
+            # executor resolves them (see constructJumpIndex) during symbolic
+            # execution, since we need to read the dest off the stack.
+            if isinstance(this_instruction, (statements.all.JMPR_Statement,
+                                             statements.all.JROT_Statement,
+                                             statements.all.JROF_Statement)):
+                self.has_jumps = True
 
             #other statements should have at least 
             #the next instruction in stream as a successor
@@ -289,6 +404,85 @@ class Body(object):
                 pending_if_stack.pop()
         return self.instructions[0]
 
+    # Jumps are rare, so the index they need is only built on first use.
+    def constructJumpIndex(self):
+        '''
+        Records the position of every statement, where control goes past
+        each IF (the start of its false branch) and ELSE (its EIF) when
+        paths are followed without the block structure, and the IF/ELSE
+        block each statement sits in.
+        '''
+        self.positions = {}
+        self.branch_ends = {}
+        self.blocks = []
+        open_blocks = []
+        for index in range(len(self.instructions)):
+            this_instruction = self.instructions[index]
+            self.positions[this_instruction] = index
+            if isinstance(this_instruction,statements.all.IF_Statement):
+                self.blocks.append(open_blocks[-1] if open_blocks else None)
+                open_blocks.append(index)
+            elif isinstance(this_instruction,statements.all.ELSE_Statement):
+                self.branch_ends[open_blocks.pop()] = index + 1
+                self.blocks.append(open_blocks[-1] if open_blocks else None)
+                open_blocks.append(index)
+            elif isinstance(this_instruction,statements.all.EIF_Statement):
+                self.branch_ends[open_blocks.pop()] = index
+                self.blocks.append(open_blocks[-1] if open_blocks else None)
+            else:
+                self.blocks.append(open_blocks[-1] if open_blocks else None)
+
+    def position(self, statement):
+        if self.positions is None:
+            self.constructJumpIndex()
+        return self.positions[statement]
+
+    def statementAt(self, position):
+        '''the statement at 'position'; None for the end of the body'''
+        if position == len(self.instructions):
+            return None
+        if position < 0 or position > len(self.instructions):
+            raise abstractExecute.JumpError("jump to position %d, outside of a body of %d statements"
+                                            % (position, len(self.instructions)))
+        return self.instructions[position]
+
+    def jumpTarget(self, statement, offset):
+        return self.statementAt(self.position(statement) + offset)
+
+    def branchEnd(self, statement):
+        '''for an IF, the start of its false branch; for an ELSE, its EIF'''
+        position = self.position(statement)
+        return self.statementAt(self.branch_ends[position])
+
+    def nextStatement(self, statement):
+        '''
+        the statement control falls through to from 'statement',
+        skipping the false branch when running into an ELSE
+        '''
+        following = self.statementAt(self.position(statement) + 1)
+        if isinstance(following, statements.all.ELSE_Statement):
+            return self.branchEnd(following)
+        return following
+
+    def sameBlock(self, statement1, statement2):
+        return self.blocks[self.position(statement1)] == self.blocks[self.position(statement2)]
+
+    def assemble(self, push):
+        '''
+        Calls push with each byte of the body's bytecode; a compact body
+        whose statements were never made is written from its compact form.
+        '''
+        if 'compact' in self.__dict__ and 'instructions' not in self.__dict__:
+            self.compact.assemble(push)
+        elif self.statement_root is not None:
+            instructionConstructor.assembleStatements(self.instructions, push)
+
+    def stackSummary(self):
+        '''the stack effects of the body, see stackEffect.summarizeBody'''
+        if self.stack_summary is None:
+            self.stack_summary = stackEffect.summarizeBody(self.instructions)
+        return self.stack_summary
+
     def pretty_print(self):
         if self.statement_root is None:
             return
@@ -298,7 +298,7 @@ class ABSMethodCall(MethodCallStatement):
 
 class CEILMethodCall(MethodCallStatement):
     def __init__(self, parameters = [], returnVal=None):
-        super(CEILINGMethodCall, self).__init__(parameters, returnVal)
+        super(CEILMethodCall, self).__init__(parameters, returnVal)
         self.methodName = 'CEIL'
     def eval(self, keep_abstract):
         p = self.parameters[0].eval(keep_abstract)
@@ -565,10 +565,9 @@ class LabelBlock(object):
         self.label = label
         self.statements = []
     def __repr__(self):
-        resStr = ""
-        resStr += self.label+'\n'
+        resStr = self.label + ':'
         for statement in self.statements:
-            resStr += str(statement)+'\n'
+            resStr += '\n    ' + str(statement)
         return resStr
 
 class IfElseBlock(object):
@@ -10,6 +10,154 @@ class IdentifierGenerator(object):
 logger = logging.getLogger(" ")
 identifierGenerator = IdentifierGenerator()
 
+def mul26dot6(a, b):
+    # rounds like FreeType's FT_MulDiv(a, b, 64)
+    product = (abs(a) * abs(b) + 32) // 64
+    if (a < 0) != (b < 0):
+        return -product
+    return product
+
+def div26dot6(a, b):
+    # truncates like FreeType's FT_MulDiv_No_Round(a, 64, b)
+    if b == 0:
+        return None
+    quotient = abs(a) * 64 // abs(b)
+    if (a < 0) != (b < 0):
+        return -quotient
+    return quotient
+
+# what the arithmetic and logical instructions compute when all their
+# operands are concrete integers; binary ones take (deeper, top) and
+# return None where the result isn't defined
+concreteBinaryOperations = {
+    'ADD':  lambda a, b: a + b,
+    'SUB':  lambda a, b: a - b,
+    'MUL':  mul26dot6,
+    'DIV':  div26dot6,
+    'MAX':  max,
+    'MIN':  min,
+    'GT':   lambda a, b: int(a > b),
+    'GTEQ': lambda a, b: int(a >= b),
+    'LT':   lambda a, b: int(a < b),
+    'LTEQ': lambda a, b: int(a <= b),
+    'EQ':   lambda a, b: int(a == b),
+    'NEQ':  lambda a, b: int(a != b),
+    'AND':  lambda a, b: int(bool(a and b)),
+    'OR':   lambda a, b: int(bool(a or b)),
+}
+concreteUnaryOperations = {
+    'abs':   abs,
+    'not':   lambda a: int(a == 0),
+    'floor': lambda a: a & -64,
+    'ceil':  lambda a: (a + 63) & -64,
+}
+
+def concreteValue(value):
+    '''value's plain integer value, or None if it isn't one'''
+    value = value.eval(False)
+    if isinstance(value, (int, long)):
+        return value
+    return None
+
+class OverlayDict(object):
+    """A dict-like map whose snapshots share the entries written so far.
+
+    Writes only ever go to the private 'local' dict; snapshot() freezes
+    it into the shared 'layers' (innermost first), so a copy costs nothing
+    up front and then grows with what is written afterwards. Overly deep
+    layer chains are flattened to keep lookups cheap.
+    """
+    MAX_LAYERS = 8
+
+    def __init__(self, base=None):
+        self.local = {}
+        if base:
+            self.layers = (base,)
+        else:
+            self.layers = ()
+
+    def snapshot(self):
+        if self.local:
+            self.layers = (self.local,) + self.layers
+            self.local = {}
+        if len(self.layers) > self.MAX_LAYERS:
+            self.layers = (self.to_dict(),)
+        copy = OverlayDict()
+        copy.layers = self.layers
+        return copy
+
+    def to_dict(self):
+        result = {}
+        for layer in reversed(self.layers):
+            result.update(layer)
+        result.update(self.local)
+        return result
+
+    def writes_since(self, earlier):
+        '''
+        Entries written since 'earlier' was snapshotted off this map's
+        history, or None if the layers got flattened in between.
+        '''
+        fresh = len(self.layers) - len(earlier.layers)
+        if fresh < 0 or earlier.local:
+            return None
+        for mine, theirs in zip(self.layers[fresh:], earlier.layers):
+            if mine is not theirs:
+                return None
+        result = {}
+        for layer in reversed(self.layers[:fresh]):
+            result.update(layer)
+        result.update(self.local)
+        return result
+
+    def __getitem__(self, key):
+        if key in self.local:
+            return self.local[key]
+        for layer in self.layers:
+            if key in layer:
+                return layer[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self.local[key] = value
+
+    def __contains__(self, key):
+        if key in self.local:
+            return True
+        for layer in self.layers:
+            if key in layer:
+                return True
+        return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def __eq__(self, other):
+        if isinstance(other, OverlayDict):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
 class Environment(object):
     """Abstractly represents the global environment at a single point in time.
 
@@ -29,11 +177,11 @@ class Environment(object):
     """
     def __init__(self, bytecodeContainer, tag):
         self.bytecodeContainer = bytecodeContainer
-        # cvt: location -> Value
-        self.cvt = copy.copy(bytecodeContainer.cvt_table)
+        # cvt: location -> Value; shares the container's table until written
+        self.cvt = OverlayDict(bytecodeContainer.cvt_table)
         self.tag = tag
         # storage_area: location -> Value
-        self.storage_area = {}
+        self.storage_area = OverlayDict()
         self.set_graphics_state_to_default()
         # this is the TT VM stack, not the call stack
         self.program_stack = []
@@ -41,7 +189,9 @@ class Environment(object):
         self.current_instruction = None
         self.current_instruction_intermediate = []
         self.keep_abstract = True
-        self.already_seen_jmpr_targets = {}
+        # False once this path has jumped away (or found nothing new at
+        # a jump target), so that it no longer flows into an EIF
+        self.reachable = True
 
     def __repr__(self):
         stackVars = []
@@ -55,25 +205,36 @@ class Environment(object):
             + ', program_stack = ' + stackRep + ', program_stack_length = ' + str(len(self.program_stack)))
 
     def __deepcopy__(self, memo):
-        cls = self.__class__
-        result = cls.__new__(cls)
+        # stack entries, CVT/storage values and statements are never
+        # mutated in place, so an independent copy needs no deep copying;
+        # only the (small) graphics state is copied in full
+        result = self.make_copy(self.bytecodeContainer)
         memo[id(self)] = result
-        for k, v in self.__dict__.items():
-            if k == 'bytecodeContainer':
-                setattr(result, k, copy.copy(v))
-            else:
-                setattr(result, k, copy.deepcopy(v, memo))
+        result.graphics_state = copy.deepcopy(self.graphics_state, memo)
         return result
 
     def make_copy(self, font):
-        new_env = Environment(font, self.tag)
+        '''
+        copy-on-write snapshot: the CVT and storage area are shared with
+        this environment, the stack and graphics state copy only their
+        references, and the current instruction is shared.
+        '''
+        new_env = Environment.__new__(Environment)
         for key, value in self.__dict__.iteritems():
-            setattr(new_env, key, copy.copy(value))
+            if isinstance(value, OverlayDict):
+                value = value.snapshot()
+            elif key not in ('bytecodeContainer', 'current_instruction'):
+                value = copy.copy(value)
+            setattr(new_env, key, value)
+        new_env.bytecodeContainer = font
         return new_env
     
-    def merge(self,environment2):
+    def merge(self,environment2, widen=False):
         '''
         merge environment2 into this one; used at control-flow (e.g. if-else, jrox) merge.
+        With widen, values that differ become unknown rather than a list
+        of possibilities, so that merging over and over at a jump target
+        stops changing anything. Returns whether this environment changed.
         '''
         if len(environment2.program_stack)!=len(self.program_stack):
             print "impending assertion failure; here's the mismatched environments"
@@ -81,24 +242,47 @@ class Environment(object):
             self.pretty_print()
         assert len(environment2.program_stack)==len(self.program_stack)
 
+        changed = False
         new_stack = []
-        for (v1, v2) in zip(self.program_stack, environment2.program_stack):
+        for (i, (v1, v2)) in enumerate(zip(self.program_stack, environment2.program_stack)):
             if (v1 == v2):
                 new_stack.append(v1)
+            elif widen:
+                if isinstance(v1, IR.Variable) and type(v1.data) is dataType.AbstractValue:
+                    new_stack.append(v1)
+                else:
+                    if isinstance(v1, IR.Variable):
+                        identifier = v1.identifier
+                    else:
+                        identifier = identifierGenerator.generateIdentifier(self.tag, i + 1)
+                    new_stack.append(IR.Variable(identifier, dataType.AbstractValue()))
+                    changed = True
             elif isinstance(v1, IR.Variable) and isinstance(v2, IR.Variable) and v1.identifier == v2.identifier:
                 new_stack.append(v1)
             else:
                 new_stack.append(dataType.UncertainValue([v1, v2]))
+                changed = True
         self.program_stack = new_stack
 
         for item in environment2.storage_area:
             if item not in self.storage_area:
-                self.append(item)
+                self.storage_area[item] = environment2.storage_area[item]
+                changed = True
+            elif widen and self.storage_area[item] != environment2.storage_area[item] and \
+                 type(self.storage_area[item]) is not dataType.AbstractValue:
+                self.storage_area[item] = dataType.AbstractValue()
+                changed = True
         '''
         deal with Graphics state
         '''
         for gs_key in self.graphics_state:
             if self.graphics_state[gs_key] != environment2.graphics_state[gs_key]:
+                if widen:
+                    if type(self.graphics_state[gs_key]) is not dataType.AbstractValue:
+                        logger.info("graphics_state %s became unknown", gs_key)
+                        self.graphics_state[gs_key] = dataType.AbstractValue()
+                        changed = True
+                    continue
                 logger.info("graphics_state %s became uncertain", gs_key)
                 new_graphics_state = set()
                 if(type(self.graphics_state[gs_key]) is dataType.UncertainValue):
@@ -110,7 +294,9 @@ class Environment(object):
                 else:
                     new_graphics_state.add(environment2.graphics_state[gs_key])
                 self.graphics_state[gs_key] = dataType.UncertainValue(list(new_graphics_state))
-                logger.info("possible values are %s", str(self.graphics_state[gs_key].possibleValues))
+                changed = True
+                logger.info("possible values are %s", self.graphics_state[gs_key].possibleValues)
+        return changed
 
     def pretty_print(self):
         print self.__repr__()
@@ -189,6 +375,7 @@ class Environment(object):
         v_name = self.stack_top_name()
         arg = self.program_stack_pop()
         v = IR.Variable(v_name, arg)
+        concrete_arg = concreteValue(arg)
 
         if action is 'ceil':
             e = IR.CEILMethodCall([arg])
@@ -198,6 +385,11 @@ class Environment(object):
             e = IR.ABSMethodCall([arg])
         elif action is 'not':
             e = IR.NOTMethodCall([arg])
+        if concrete_arg is not None:
+            # same IR, but what goes on the stack is just the int
+            self.program_stack_push(concreteUnaryOperations[action](concrete_arg), False)
+            self.current_instruction_intermediate.append(IR.OperationAssignmentStatement(v, e))
+            return
         res = e.eval(self.keep_abstract)
         self.program_stack_push(res, False)
         self.current_instruction_intermediate.append(IR.OperationAssignmentStatement(v, res))
@@ -208,14 +400,29 @@ class Environment(object):
         op1_val = self.program_stack_pop()
         op2_var = self.stack_top_name()
         op2_val = self.program_stack_pop()
-        op1 = op1_val.eval(self.keep_abstract)
-        op2 = op2_val.eval(self.keep_abstract)
 
         expression = None
         if action is 'MAX' or action is 'MIN':
             e = IR.PrefixBinaryExpression
         else:
             e = IR.InfixBinaryExpression
+
+        if self.keep_abstract:
+            # fast path: concrete operands get a plain int result rather
+            # than a dataType.Expression; the IR is the same either way
+            first = concreteValue(op2_val)
+            second = concreteValue(op1_val)
+            if first is not None and second is not None:
+                res = concreteBinaryOperations[action](first, second)
+                if res is not None:
+                    var = self.program_stack_push(res, False)
+                    expression = e(op1_var, op2_var, getattr(IR, action+'Operator')())
+                    self.current_instruction_intermediate.append(
+                        IR.OperationAssignmentStatement(var, expression))
+                    return
+
+        op1 = op1_val.eval(self.keep_abstract)
+        op2 = op2_val.eval(self.keep_abstract)
         if isinstance(op1,dataType.AbstractValue) or isinstance(op2,dataType.AbstractValue):
             res = dataType.Expression(op1, op2, action)
             expression = e(op1_var, op2_var, getattr(IR, action+'Operator')())
@@ -475,36 +682,9 @@ class Environment(object):
         else:
             return self.bytecodeContainer.tag_to_programs[self.tag].body
 
-    def adjust_succ_for_relative_jump(self, arg, only_succ):
-        # find the instructions and set the PC
-        # returns True if we broke a cycle
-        assert not isinstance(arg, dataType.AbstractValue)
-        ins = self.fetch_body_for_tag(self.tag).instructions
-        pc = 0
-        # note use of 'is' rather than normal equality
-        for i in range(len(ins)):
-            if self.current_instruction is ins[i]:
-                break
-            pc += 1
-        assert pc < len(ins)
-
-        target = ins[pc+arg]
-        if only_succ:
-            self.current_instruction.successors = []
-        if not target in self.current_instruction.successors:
-            self.already_seen_jmpr_targets.setdefault(self.tag, [])
-            if not target in self.already_seen_jmpr_targets[self.tag]:
-                self.current_instruction.successors.append(target)
-                self.already_seen_jmpr_targets[self.tag].append(target)
-            else:
-                return True
-        return False
-
+    # jumps are taken by the Executor, which needs to see the whole body
     def exec_JMPR(self):
-        arg = self.program_stack_pop().eval(False)
-        assert not isinstance(arg, dataType.AbstractValue)
-        if self.adjust_succ_for_relative_jump(arg, True):
-            self.current_instruction_intermediate.append(IR.JmpStatement(arg))
+        pass
     def exec_JROF(self):
         pass
     def exec_JROT(self):
@@ -922,9 +1102,221 @@ class Environment(object):
     def execute_current_instruction(self, ins):
         self.current_instruction_intermediate = []
         self.current_instruction = ins
-        getattr(self,"exec_"+self.current_instruction.mnemonic)()
+        self.exec_table[ins.mnemonic](self)
         return self.current_instruction_intermediate
 
+# mnemonic -> Environment.exec_<mnemonic>, to dispatch on without building
+# the method name and looking it up for every instruction executed
+Environment.exec_table = dict((name[len("exec_"):], method)
+                              for name, method in vars(Environment).items()
+                              if name.startswith("exec_"))
+
+def concrete_signature(value):
+    '''
+    Hashable stand-in for a concrete value, or None if 'value' is
+    (or contains) something abstract. The type is part of the
+    signature so that e.g. True and 1 don't collide.
+    '''
+    if isinstance(value, (bool, int, long, float)):
+        return (type(value).__name__, value)
+    if isinstance(value, (tuple, list)):
+        result = []
+        for v in value:
+            s = concrete_signature(v)
+            if s is None:
+                return None
+            result.append(s)
+        return tuple(result)
+    return None
+
+class ProgramError(Exception):
+    '''
+    raised for an error in a program that stops executing it, but not
+    the analysis of the others
+    '''
+
+class JumpError(ProgramError):
+    '''
+    raised for a jump that can't be followed: out of its program or
+    function, or by an offset that isn't known
+    '''
+
+class CallError(ProgramError):
+    '''raised for a call to a function fpgm doesn't define'''
+
+class FunctionSummary(object):
+    '''
+    The effect of one call of an fpgm function, recorded so that later
+    calls with the same concrete inputs can skip re-executing the body.
+
+    The inputs are the stack depth at the call, the top 'used' stack
+    entries (the only ones the body touched) and the graphics state;
+    CVT and storage contents are never read while keep_abstract is set.
+    '''
+    def __init__(self, used, args, outputs, graphics_state_writes,
+                 cvt_writes, storage_writes, calls,
+                 minimum_stack_depth, maximum_stack_depth):
+        self.used = used
+        self.args = args
+        self.outputs = outputs
+        self.graphics_state_writes = graphics_state_writes
+        self.cvt_writes = cvt_writes
+        self.storage_writes = storage_writes
+        self.calls = calls
+        self.minimum_stack_depth = minimum_stack_depth
+        self.maximum_stack_depth = maximum_stack_depth
+
+class SummaryFrame(object):
+    '''
+    Bookkeeping for a function call in progress, from which its
+    FunctionSummary gets built upon RETURN.
+    '''
+    def __init__(self, key, environment, calls_start):
+        self.key = key
+        self.cacheable = key is not None
+        self.entry_stack = environment.program_stack
+        self.entry_depth = len(environment.program_stack)
+        self.entry_graphics_state = dict(environment.graphics_state)
+        self.entry_cvt = environment.cvt.snapshot()
+        self.entry_storage_area = environment.storage_area.snapshot()
+        self.calls_start = calls_start
+        # lowest stack depth read or written by the body so far
+        self.low = self.entry_depth
+        self.maximum_stack_depth = 0
+
+class Lazy(object):
+    '''Formats as what 'function' returns, which is only called then.'''
+    def __init__(self, function):
+        self.function = function
+    def __str__(self):
+        return str(self.function())
+
+class TraceRecord(object):
+    '''
+    A step of an execution traced by Executor.trace: its logging level,
+    what kind of step it is ('instruction', 'call', 'return', 'branch',
+    'jump' or 'execute'), the tag executing, and a message with
+    arguments which is only formatted by getMessage() or str().
+    '''
+    def __init__(self, level, event, tag, message, args):
+        self.level = level
+        self.event = event
+        self.tag = tag
+        self.message = message
+        self.args = args
+    def getMessage(self):
+        if self.args:
+            return self.message % self.args
+        return self.message
+    def __str__(self):
+        return "%s %s: %s" % (self.event, self.tag, self.getMessage())
+
+class InstructionProfile(object):
+    '''
+    Counts the instructions an Executor executes, per call stack: the
+    program's tag followed by the fpgm_N tags of the functions called.
+    Abstract execution goes down both sides of every IF, so these are
+    the instructions of all the paths, not of one rasterization.
+    '''
+    def __init__(self):
+        # call stack (tuple of tags) -> instructions executed
+        self.counts = {}
+
+    def count(self, stack):
+        self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def flat(self):
+        '''tag -> [inclusive, exclusive] instructions executed'''
+        result = {}
+        for stack, count in self.counts.items():
+            for tag in set(stack):
+                result.setdefault(tag, [0, 0])[0] += count
+            result[stack[-1]][1] += count
+        return result
+
+    def write_collapsed(self, f):
+        '''writes the counts as collapsed stacks ("prep;fpgm_2;fpgm_1 12"), for flame graphs'''
+        for stack, count in sorted(self.counts.items()):
+            f.write("%s %d\n" % (";".join(stack), count))
+
+class Breadcrumbs(object):
+    '''
+    Jump targets still to be visited in the current function or program.
+
+    Every path reaching a target is joined into the state recorded
+    there (with widening, see Environment.merge) and the target is only
+    visited again if that state changed, so loops reach a fixpoint.
+    Paths followed from a target ignore the IF/ELSE block structure and
+    only emit IR for statements that have none yet, into a LabelBlock.
+    '''
+    # give up on a target merged into more often than this
+    MAX_JOINS = 32
+
+    def __init__(self, tracking=False):
+        # only bodies with jumps need to track which statements have IR
+        self.tracking = tracking
+        self.pending = []
+        self.joined = {}
+        self.joins = {}
+        self.exit_environment = None
+        self.emitted = set()
+        self.propagating = False
+        self.emitting = True
+        self.label = None
+        self.label_name = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, statement, environment):
+        self.tracking = True
+        self.pending.append((statement, environment))
+
+    def visit(self, statement):
+        self.emitting = not self.propagating or statement not in self.emitted
+        self.emitted.add(statement)
+
+    def append_IR(self, intermediateCodes, ins):
+        if not self.emitting or len(ins) == 0:
+            return
+        if self.label is None:
+            self.label = IR.LabelBlock(self.label_name)
+            intermediateCodes.append(self.label)
+        self.label.statements.extend(ins)
+
+    def join_exit(self, environment):
+        if self.exit_environment is None:
+            self.exit_environment = environment
+        elif len(self.exit_environment.program_stack) != len(environment.program_stack):
+            logger.warn("stack height at the end differs between paths; keeping the first")
+        else:
+            self.exit_environment.merge(environment)
+
+    def resume(self, font):
+        '''
+        Takes the next pending target; returns it with the environment
+        to go on with, or None if joining found nothing new there.
+        '''
+        statement, environment = self.pending.pop()
+        if statement not in self.joined:
+            self.joined[statement] = environment
+            self.joins[statement] = 0
+        else:
+            joined = self.joined[statement]
+            self.joins[statement] += 1
+            if len(joined.program_stack) != len(environment.program_stack):
+                logger.warn("stack height at jump target %s differs between paths; not following", statement.id)
+                return None
+            if self.joins[statement] > self.MAX_JOINS:
+                logger.warn("no fixpoint at jump target %s; giving up on it", statement.id)
+                return None
+            if not joined.merge(environment, True):
+                return None
+        self.propagating = True
+        self.label = None
+        self.label_name = statement.id
+        return (statement, self.joined[statement].make_copy(font))
+
 class Executor(object):
     """
     Given a TrueType instruction, abstractly transform the global state.
@@ -934,6 +1326,9 @@ class Executor(object):
 
     As a side effect, puts intermediate code in field "intermediateCodes".
     """
+    # summaries kept per (callee, stack depth, graphics state)
+    MAX_SUMMARIES = 16
+
     def __init__(self,bc):
         self.bytecodeContainer = bc
         self.environment = Environment(bc, "")
@@ -942,12 +1337,45 @@ class Executor(object):
         self.maximum_stack_depth = 0
         self.call_stack = []
         self.stored_environments = {}
-        self.breadcrumbs = []
+        self.breadcrumbs = Breadcrumbs()
         self.if_else = None
         # generated as a side effect:
         self.intermediateCodes = []
         self.global_function_table = {}
+        # caller tag -> {callee: # calls}
+        self.call_graph = {}
+        # (caller tag, callee) for each call of the current program
+        self.calls = []
         self.visited_functions = set()
+        # program tag -> the ProgramError that stopped it, see analysis.analysis
+        self.errors = {}
+        self.use_function_summaries = True
+        # (callee, stack depth, graphics state) -> [FunctionSummary]
+        self.function_summaries = {}
+        self.summary_frames = []
+        # gets a TraceRecord for each step traced, instead of the logger
+        self.trace_sink = None
+        # whether execute() traces each instruction
+        self.tracing = False
+        # an InstructionProfile counting the instructions executed, or None
+        self.profile = None
+
+    def trace(self, level, event, message, *args):
+        if self.trace_sink is not None:
+            self.trace_sink(TraceRecord(level, event, self.environment.tag, message, args))
+        elif logger.isEnabledFor(level):
+            logger.log(level, message, *args)
+
+    def trace_instruction(self):
+        if self.pc.data is not None:
+            self.trace(logging.INFO, 'instruction', "[pc] %s->%s|%s", self.pc.id, self.pc.mnemonic, self.pc.data)
+        else:
+            self.trace(logging.INFO, 'instruction', "[pc] %s->%s", self.pc.id, self.pc.mnemonic)
+        self.trace(logging.INFO, 'instruction', "succs are %s", self.pc.successors)
+        self.trace(logging.INFO, 'instruction', "call_stack len is %s", len(self.call_stack))
+        stack = list(self.environment.program_stack)
+        self.trace(logging.INFO, 'instruction', "program_stack is %s",
+                   Lazy(lambda: map(lambda s:s.eval(False), stack)))
 
     def initialize_graphics_state(self):
         self.intermediateCodes = []
@@ -980,11 +1408,232 @@ class Executor(object):
         return self.environment.stack_depth()
 
     def appendIntermediateCode(self, ins):
-        if len(self.if_else.IR) > 0:
+        if self.breadcrumbs.propagating:
+            self.breadcrumbs.append_IR(self.intermediateCodes, ins)
+        elif len(self.if_else.IR) > 0:
             self.if_else.IR[-1].appendStatements(ins)
         else:
             self.intermediateCodes.extend(ins)
 
+    def function_has_jumps(self, callee):
+        # the paths a jump feeds only emit IR for statements that have
+        # none yet, so such functions don't produce the same IR twice
+        return self.bytecodeContainer.function_table[callee].body.has_jumps
+
+    def current_body(self):
+        return self.environment.fetch_body_for_tag(self.environment.tag)
+
+    def execute_jump(self):
+        jump = self.pc
+        body = self.current_body()
+        arg = self.environment.program_stack_pop().eval(False)
+        if isinstance(arg, dataType.AbstractValue):
+            raise JumpError("jump by an unknown offset at %s" % jump.id)
+        target = body.jumpTarget(jump, arg)
+        if target is None:
+            label = 'end'
+        else:
+            label = target.id
+        if jump.mnemonic == 'JMPR':
+            taken, falls_through = True, False
+            self.appendIntermediateCode([IR.JmpStatement(label)])
+        else:
+            e = self.environment.program_stack_pop().eval(self.environment.keep_abstract)
+            self.trace(logging.INFO, 'jump', "executing jrot/jrof for %s, stack height is %d", e, self.stack_depth())
+            self.appendIntermediateCode([IR.JROxStatement(jump.mnemonic == 'JROT', e, label)])
+            c = e.eval(False)
+            if isinstance(c, dataType.AbstractValue):
+                taken, falls_through = True, True
+            else:
+                taken = bool(c) == (jump.mnemonic == 'JROT')
+                falls_through = not taken
+
+        if falls_through:
+            if taken:
+                self.leave_breadcrumb(target, self.environment.make_copy(self.bytecodeContainer))
+            self.advance()
+        elif (not self.breadcrumbs.propagating and target is not None and
+              arg > 0 and body.sameBlock(jump, target)):
+            # a forward jump within the block just skips some statements
+            self.pc = target
+        else:
+            self.leave_breadcrumb(target, self.environment)
+            self.end_of_path(False)
+
+    def leave_breadcrumb(self, target, environment):
+        if target is None:
+            # jumping to the end
+            self.trace(logging.INFO, 'jump', "jump to the end of %s", self.environment.tag)
+            self.breadcrumbs.join_exit(environment)
+        else:
+            self.trace(logging.INFO, 'jump', "leaving a breadcrumb at %s", target.id)
+            self.breadcrumbs.add(target, environment)
+
+    def propagate_branch(self):
+        # paths from a jump target take both sides of an IF as plain jumps
+        body = self.current_body()
+        if self.pc.mnemonic == 'IF':
+            cond = self.environment.program_stack.pop()
+            c = cond.eval(False)
+            if isinstance(c, dataType.AbstractValue):
+                self.leave_breadcrumb(body.branchEnd(self.pc),
+                                      self.environment.make_copy(self.bytecodeContainer))
+            elif not c:
+                self.pc = body.branchEnd(self.pc)
+                if self.pc is None:
+                    self.end_of_path(True)
+                return
+        elif self.pc.mnemonic == 'ELSE':
+            self.pc = body.branchEnd(self.pc)
+            return
+        self.advance()
+
+    def advance(self):
+        # move on from self.pc, which has at most one successor
+        if len(self.pc.successors) > 0:
+            self.pc = self.pc.successors[0]
+        elif self.breadcrumbs.propagating:
+            self.pc = self.current_body().nextStatement(self.pc)
+            if self.pc is None:
+                self.end_of_path(True)
+        else:
+            self.end_of_path(True)
+
+    def end_of_path(self, exits):
+        '''
+        The current path ended, at the end of a branch or function
+        (exits) or by jumping away or finding nothing new at a jump
+        target; find out where to carry on.
+        '''
+        # reached end of function, still have if/else succs to explore
+        if len(self.if_else.env) > 0:
+            if not exits:
+                self.environment.reachable = False
+            # return to the closest enclosing IF
+            self.pc = self.if_else.env[-1][0]
+            self.trace(logging.INFO, 'branch', "program pointer back (if) to %s %s", self.pc, self.pc.id)
+            return
+        if exits and (len(self.breadcrumbs) > 0 or self.breadcrumbs.exit_environment is not None):
+            self.breadcrumbs.join_exit(self.environment)
+        # paths that jumps feed have yet to reach their fixpoint
+        while len(self.breadcrumbs) > 0:
+            resumed = self.breadcrumbs.resume(self.bytecodeContainer)
+            if resumed is not None:
+                (self.pc, self.environment) = resumed
+                self.trace(logging.INFO, 'jump', "following breadcrumb to %s", self.pc.id)
+                return
+        if self.breadcrumbs.exit_environment is not None:
+            self.environment = self.breadcrumbs.exit_environment
+        self.environment.reachable = True
+        self.breadcrumbs.propagating = False
+        # reached end of function, but we're still in a call
+        # ie handle RETURN
+        if len(self.call_stack) > 0:
+            self.execute_RETURN(self.program_tag)
+        # ok, we really are all done here!
+        else:
+            self.pc = None
+
+    def stack_signature(self, program_stack, used):
+        result = []
+        for s in program_stack[len(program_stack) - used:]:
+            if not isinstance(s, IR.Variable):
+                return None
+            sig = concrete_signature(s.data)
+            if sig is None:
+                return None
+            result.append(sig)
+        return tuple(result)
+
+    def find_function_summary(self, callee):
+        '''
+        Returns (key, summary): the summary recorded for an earlier call
+        of 'callee' with the same inputs, if any, and the key under which
+        this call's summary should be stored (None if it can't be).
+        '''
+        # (reusing a summary skips the instructions a profile counts)
+        if (not self.use_function_summaries or not self.environment.keep_abstract or
+            self.profile is not None):
+            return (None, None)
+        if callee not in self.bytecodeContainer.function_table or self.function_has_jumps(callee):
+            return (None, None)
+        gs_signature = []
+        for gs_key, value in sorted(self.environment.graphics_state.items()):
+            sig = concrete_signature(value)
+            if sig is None:
+                return (None, None)
+            gs_signature.append((gs_key, sig))
+        key = (callee, self.stack_depth(), tuple(gs_signature))
+        for summary in self.function_summaries.get(key, []):
+            if self.stack_signature(self.environment.program_stack, summary.used) == summary.args:
+                return (key, summary)
+        return (key, None)
+
+    def apply_function_summary(self, summary):
+        environment = self.environment
+        entry_depth = self.stack_depth()
+        environment.replace_locals_with_formals()
+        environment.program_stack[entry_depth - summary.used:] = summary.outputs
+        for gs_key, value in summary.graphics_state_writes:
+            environment.graphics_state[gs_key] = value
+        for index, value in summary.cvt_writes.items():
+            environment.cvt[index] = value
+        for index, value in summary.storage_writes.items():
+            environment.storage_area[index] = value
+        for caller, callee in summary.calls:
+            self.count_call(caller, callee)
+        environment.minimum_stack_depth = summary.minimum_stack_depth
+        if summary.maximum_stack_depth > self.maximum_stack_depth:
+            self.maximum_stack_depth = summary.maximum_stack_depth
+        if len(self.summary_frames) > 0:
+            frame = self.summary_frames[-1]
+            frame.low = min(frame.low, entry_depth - summary.used)
+            frame.maximum_stack_depth = max(frame.maximum_stack_depth,
+                                            summary.maximum_stack_depth)
+
+    def store_function_summary(self, frame):
+        if len(self.summary_frames) > 0:
+            # the caller saw everything the callee did
+            outer = self.summary_frames[-1]
+            outer.low = min(outer.low, frame.low)
+            outer.maximum_stack_depth = max(outer.maximum_stack_depth,
+                                            frame.maximum_stack_depth)
+            outer.cacheable = outer.cacheable and frame.cacheable
+        if not frame.cacheable:
+            return
+        summaries = self.function_summaries.setdefault(frame.key, [])
+        if len(summaries) >= self.MAX_SUMMARIES:
+            return
+        environment = self.environment
+        used = frame.entry_depth - frame.low
+        args = self.stack_signature(frame.entry_stack, used)
+        cvt_writes = environment.cvt.writes_since(frame.entry_cvt)
+        storage_writes = environment.storage_area.writes_since(frame.entry_storage_area)
+        if args is None or cvt_writes is None or storage_writes is None:
+            return
+        graphics_state_writes = []
+        for gs_key, value in environment.graphics_state.items():
+            if gs_key not in frame.entry_graphics_state or \
+               frame.entry_graphics_state[gs_key] != value:
+                graphics_state_writes.append((gs_key, value))
+        summaries.append(FunctionSummary(used, args,
+                                         environment.program_stack[frame.low:],
+                                         graphics_state_writes, cvt_writes, storage_writes,
+                                         self.calls[frame.calls_start:],
+                                         environment.minimum_stack_depth,
+                                         frame.maximum_stack_depth))
+
+    def note_stack_access(self, depth):
+        if len(self.summary_frames) > 0 and depth < self.summary_frames[-1].low:
+            self.summary_frames[-1].low = depth
+
+    def count_call(self, caller, callee):
+        self.program.call_function_set.append(callee)
+        self.calls.append((caller, callee))
+        self.global_function_table[callee] = self.global_function_table.get(callee, 0) + 1
+        callees = self.call_graph.setdefault(caller, {})
+        callees[callee] = callees.get(callee, 0) + 1
+
     def execute_LOOPCALL(self):
         count = self.environment.program_stack[-2].eval(False)
         if isinstance(count, dataType.AbstractValue):
@@ -998,37 +1647,46 @@ class Executor(object):
         # actually we *always* want to get the concrete callee
         callee = self.environment.program_stack[-1].eval(False)
         assert not isinstance(callee, dataType.AbstractValue)
+        if callee not in self.bytecodeContainer.function_table:
+            raise CallError("call to undefined function %s at %s" % (callee, self.pc.id))
 
         # update call graph counts
-        self.program.call_function_set.append(callee)
-        if callee not in self.global_function_table:
-            self.global_function_table[callee] = 1
-        else:
-            self.global_function_table[callee] += 1
+        self.count_call(self.environment.tag, callee)
 
         # execute the call instruction itself
         self.environment.execute_current_instruction(self.pc)
 
         self.environment.minimum_stack_depth = self.stack_depth()
-        # set call stack & jump
-        # yuck should regularize the CFG with tail nodes to avoid needing this hack
-        if (len(self.pc.successors) == 0):
-            succ = None
-        else:
-            succ = self.pc.successors[0]
-        self.call_stack.append((callee, succ, self.intermediateCodes,
-                                self.environment.tag, copy.copy(self.environment.program_stack),
+        caller_program_stack = copy.copy(self.environment.program_stack)
+
+        key, summary = self.find_function_summary(callee)
+        if summary is not None:
+            self.trace(logging.INFO, 'call', "in %s, reusing summary of function %d", self.environment.tag, callee)
+            self.apply_function_summary(summary)
+            self.finish_CALL(self.program_tag, callee, caller_program_stack, repeats)
+            self.advance()
+            return
+
+        # set call stack & jump; we carry on from the CALL upon RETURN
+        self.summary_frames.append(SummaryFrame(key, self.environment, len(self.calls)))
+        self.call_stack.append((callee, self.pc, self.intermediateCodes,
+                                self.environment.tag, caller_program_stack,
                                 self.stored_environments, self.breadcrumbs, self.if_else, repeats))
         self.if_else = self.If_else_stack([], [], [])
-        logger.info("in %s, calling function %d" % (self.environment.tag, callee))
-        self.pc = self.bytecodeContainer.function_table[callee].start()
+        self.trace(logging.INFO, 'call', "in %s, calling function %d", self.environment.tag, callee)
+        function = self.bytecodeContainer.function_table[callee]
+        self.pc = function.start()
         self.intermediateCodes = []
         self.environment.tag = "fpgm_%s" % callee
         self.environment.replace_locals_with_formals()
         self.stored_environments = {}
+        self.breadcrumbs = Breadcrumbs(function.body.has_jumps)
+        if self.pc is None:
+            # empty function
+            self.end_of_path(True)
 
     def execute_RETURN(self, tag):
-        logger.info("returning from %s", self.environment.tag)
+        self.trace(logging.INFO, 'return', "returning from %s", self.environment.tag)
         if self.environment.tag in self.visited_functions:
             # calling a function for a second time
             # assert that self.intermediateCodes == bytecodeContainer.IRs[tag]
@@ -1036,10 +1694,18 @@ class Executor(object):
         else:
             self.bytecodeContainer.IRs[self.environment.tag] = self.intermediateCodes
         self.visited_functions.add(self.environment.tag)
+        self.store_function_summary(self.summary_frames.pop())
         (callee, self.pc, self.intermediateCodes, self.environment.tag,
          caller_program_stack, self.stored_environments, self.breadcrumbs,
          self.if_else, repeats) = self.call_stack.pop()
+        self.finish_CALL(tag, callee, caller_program_stack, repeats)
+        self.advance()
 
+    def finish_CALL(self, tag, callee, caller_program_stack, repeats):
+        '''
+        Back in the caller: account for the return values and emit the
+        CALL into the caller's IR.
+        '''
         stack_depth_upon_call = len(caller_program_stack)
         stack_used = stack_depth_upon_call - self.environment.minimum_stack_depth
         stack_additional = self.stack_depth() - stack_depth_upon_call
@@ -1078,14 +1744,20 @@ class Executor(object):
 
         self.appendIntermediateCode(['%sCALL%s %s%s' % (call_rv, repeats_str, str(callee), call_args)])
 
-        logger.info("pop call stack, next is %s", str(self.pc))
-        logger.info("stack used %d/stack additional %d" % (stack_used, stack_additional))
+        self.trace(logging.INFO, 'return', "pop call stack, back at %s", self.pc)
+        self.trace(logging.INFO, 'return', "stack used %d/stack additional %d", stack_used, stack_additional)
 
     def execute(self, tag):
-        logger.info("execute; tag is %s", tag)
+        self.tracing = self.trace_sink is not None or logger.isEnabledFor(logging.INFO)
+        self.trace(logging.INFO, 'execute', "execute; tag is %s", tag)
         self.environment.tag = tag
+        self.program_tag = tag
+        self.summary_frames = []
+        self.calls = []
         self.program = self.bytecodeContainer.tag_to_programs[tag]
         self.pc = self.program.start()
+        self.stored_environments = {}
+        self.breadcrumbs = Breadcrumbs(self.program.body.has_jumps)
 
         self.if_else = self.If_else_stack([], [], [])
         self.intermediateCodes = []
@@ -1095,18 +1767,22 @@ class Executor(object):
             self.initialize_graphics_state()
 
         while self.pc is not None:
-            if self.pc.data is not None:
-                logger.info("[pc] %s->%s|%s",self.pc.id,self.pc.mnemonic,self.pc.data)
-            else:
-                logger.info("[pc] %s->%s",self.pc.id,self.pc.mnemonic)
-            logger.info("succs are %s", self.pc.successors)
-            logger.info("call_stack len is %s", len(self.call_stack))
-            logger.info("program_stack is %s", str(map(lambda s:s.eval(False), self.environment.program_stack)))
+            if self.tracing:
+                self.trace_instruction()
+            if self.profile is not None:
+                self.profile.count((self.program_tag,) +
+                                   tuple("fpgm_%s" % frame[0] for frame in self.call_stack))
+
+            if self.breadcrumbs.tracking:
+                self.breadcrumbs.visit(self.pc)
 
+            depth_before = self.stack_depth()
             if self.pc.mnemonic == 'CALL':
+                self.note_stack_access(depth_before - 1)
                 self.execute_CALL()
                 continue
             elif self.pc.mnemonic == 'LOOPCALL':
+                self.note_stack_access(depth_before - 2)
                 self.execute_LOOPCALL()
                 continue
 
@@ -1119,62 +1795,35 @@ class Executor(object):
             # if new, just analyze with the stored environment
             # if already-visited, need to abstractly execute with new env
             # and see if we need to change anything.
-
-            # when we emit code, fix up the destination.
-            if self.pc.mnemonic == 'JROT' or self.pc.mnemonic == 'JROF':
-                logger.info("polling stored_environments for %s" % (self.pc.id))
-                if self.pc.id in self.stored_environments:
-                    assert false
-                    # TODO convert code below from handling ifs to handling jumps
-                    # logger.warn("jump back to %s", self.pc.id)
-                    # # back at the jmp and ready to traverse next branch...
-                    # top_if = self.if_else.env[-1][0]
-                    # # might want to process block somehow also
-                    # block = self.if_else.IR.pop()
-                    # if top_if.id not in self.stored_environments:
-                    #     logger.warn("STORE %s program state ", top_if.id)
-                    #     self.stored_environments[top_if.id] = [self.environment]
-                    # else:
-                    #     logger.warn("APPEND %s (%s) program state ", top_if.id, top_if)
-                    #     self.stored_environments[top_if.id].append(self.environment)
-                    #     self.stored_environments[top_if.id][0].merge(self.stored_environments[top_if.id][1])
-                    #     self.environment = self.stored_environments[top_if.id][0]
-                    #     self.if_else.env.pop()
-                    #     self.if_else.state.pop()
-                    #     self.appendIntermediateCode([block])
-                else:
-                    # first time round at this JROT/JROF statement...
-                    arg = self.environment.program_stack_pop().eval(False)
-                    e = self.environment.program_stack_pop().eval(self.environment.keep_abstract)
-                    logger.info("executing jrot/jrof for %s, stack height is %d" % (str(e), self.stack_depth()))
-                    assert not isinstance(arg, dataType.AbstractValue)
-                    self.appendIntermediateCode([IR.JROxStatement(self.pc.mnemonic == 'JROT', e, arg)])
-                    self.environment.adjust_succ_for_relative_jump(arg, False)
-                    branch_succ = self.environment.current_instruction.successors[-1]
-
-                    environment_copy = self.environment.make_copy(self.bytecodeContainer)
-                    assert not branch_succ.id in self.stored_environments
-                    # TODO actually we should go through the code first and populate stored_environments
-                    # TODO we should also add a breadcrumb pointing to the other succ
-                    logger.info("putting %s in stored_environments" % (branch_succ.id))
-                    self.stored_environments[branch_succ.id] = [environment_copy]
+            if self.pc.mnemonic in ('JMPR', 'JROT', 'JROF'):
+                self.execute_jump()
+                continue
+            if self.breadcrumbs.propagating and self.pc.mnemonic in ('IF', 'ELSE', 'EIF'):
+                self.propagate_branch()
+                continue
 
             if self.pc.mnemonic == 'IF':
                 if len(self.if_else.env) > 0 and self.if_else.env[-1][0] == self.pc:
                     # back at the if and ready to traverse next branch...
                     top_if = self.if_else.env[-1][0]
                     if top_if.id not in self.stored_environments:
-                        logger.warn("STORE %s program state ", top_if.id)
+                        self.trace(logging.WARNING, 'branch', "STORE %s program state ", top_if.id)
                         self.stored_environments[top_if.id] = [self.environment]
                     else:
-                        logger.warn("APPEND %s program state ", top_if.id)
+                        self.trace(logging.WARNING, 'branch', "APPEND %s program state ", top_if.id)
                         self.stored_environments[top_if.id].append(self.environment)
-                        self.stored_environments[top_if.id][0].merge(self.stored_environments[top_if.id][1])
-                        self.environment = self.stored_environments[top_if.id][0]
+                        (first, second) = self.stored_environments[top_if.id][:2]
+                        # branches that jumped away don't flow into the EIF
+                        if not first.reachable:
+                            self.environment = second
+                        else:
+                            if second.reachable:
+                                first.merge(second)
+                            self.environment = first
                 else:
                     # first time round at this if statement...
                     cond = self.environment.program_stack.pop()
-                    logger.info("entering if block for %s, stack height is %d" % (str(cond), self.stack_depth()))
+                    self.trace(logging.INFO, 'branch', "entering if block for %s, stack height is %d", cond, self.stack_depth())
                     newBlock = IR.IfElseBlock(cond,
                                               len(self.if_else.env) + 1)
 
@@ -1192,45 +1841,45 @@ class Executor(object):
                 block = self.if_else.IR.pop()
                 self.appendIntermediateCode([block])
 
+            # how deep into the stack this instruction reaches, for summaries
+            reads = self.pc.pop_num
+            if len(self.summary_frames) > 0 and self.pc.mnemonic in ('CINDEX', 'MINDEX'):
+                index = self.environment.program_stack[-1].eval(False)
+                if isinstance(index, (int, long)):
+                    reads = 1 + index
+                else:
+                    self.summary_frames[-1].cacheable = False
+
             intermediateCodes = self.environment.execute_current_instruction(self.pc)
-            if self.stack_depth() > self.maximum_stack_depth:
-                self.maximum_stack_depth = self.stack_depth()
+            depth = self.stack_depth()
+            if depth > self.maximum_stack_depth:
+                self.maximum_stack_depth = depth
+            if len(self.summary_frames) > 0:
+                frame = self.summary_frames[-1]
+                if depth > frame.maximum_stack_depth:
+                    frame.maximum_stack_depth = depth
+                if reads == 'ALL':
+                    self.note_stack_access(depth)
+                else:
+                    self.note_stack_access(min(depth_before - reads, depth))
 
             self.appendIntermediateCode(intermediateCodes)
 
-            # normal case: 1 succ
-            if len(self.pc.successors) == 1:
-                self.pc = self.pc.successors[0]
+            if self.pc.mnemonic == 'EIF' and not self.environment.reachable:
+                # every branch of this IF jumped away
+                self.end_of_path(False)
             # multiple succs, store the alternate succ for later
             elif len(self.pc.successors) > 1:
                 self.pc = self.pc.successors[self.if_else.state[-1]]
-                logger.info("traverse another branch %s->%s", self.pc.id, self.pc.mnemonic)
+                self.trace(logging.INFO, 'branch', "traverse another branch %s->%s", self.pc.id, self.pc.mnemonic)
                 if self.if_else.state[-1] > 0 and (self.pc.mnemonic != 'EIF' or self.if_else.state[-1] != 2):
-                    logger.info("program environment recover to")
                     self.environment = self.if_else.env[-1][1]
-                    logger.info(self.environment)
+                    self.trace(logging.INFO, 'branch', "program environment recover to %s", self.environment)
                 if self.pc.mnemonic == 'EIF':
                     self.if_else.env.pop()
                     self.if_else.state.pop()
                 else:
                     self.if_else.state[-1] = self.if_else.state[-1] + 1
-            # ok, no succs
             else:
-                assert len(self.pc.successors) == 0
-                # reached end of function, still have if/else succs to explore
-                if len(self.if_else.env) > 0:
-                    # return to the closest enclosing IF
-                    self.pc = self.if_else.env[-1][0]
-                    logger.info("program pointer back (if) to %s %s", str(self.pc),str(self.pc.id))
-                # reached end of function, but we're still in a call
-                # ie handle RETURN
-                elif len(self.call_stack) > 0:
-                    while True:
-                        self.execute_RETURN(tag)
-                        if len(self.call_stack) == 0 or self.pc is not None:
-                            break
-                # ok, we really are all done here!
-                else:
-                    assert len(self.if_else.env)==0
-                    self.pc = None
+                self.advance()
         self.bytecodeContainer.IRs[tag] = self.intermediateCodes
@@ -0,0 +1,381 @@
+'''
+Concrete execution of prep and the glyph programs at given ppem sizes.
+
+Unlike abstractExecute, which explores every branch with the values
+that depend on the size (MPPEM, MPS, the scaled CVT) left symbolic,
+this runs the programs at one size, following only the branches
+taken. The outline isn't known, so what is measured off it (GC, MD,
+...) is unknown (None); a program that needs such a value to decide a
+branch, a call or a jump stops with an error, as does one running for
+more than ConcreteState.MAX_STEPS instructions. Jump offsets are
+counted in statements (a run of PUSH instructions being one), as in
+abstractExecute, rather than in bytes as a rasterizer counts them.
+
+Everything prep does before it first needs the size is the same at
+all sizes, so simulate() runs that part once and carries on from a
+copy of the state it left for each size.
+'''
+from fontTools.ttLib.instructions.abstractExecute import \
+    concreteBinaryOperations, concreteUnaryOperations, ProgramError
+from fontTools.ttLib.instructions import stackEffect
+
+# what GETINFO reports, see exec_GETINFO in abstractExecute
+ENGINE_VERSION = 35
+GRAYSCALE = 1 << 12
+
+# the instructions popping a point per iteration of the loop variable
+LOOPING = frozenset(['ALIGNRP', 'FLIPPT', 'IP', 'SHP', 'SHPIX'])
+
+class NeedsPpem(Exception):
+    '''raised where execution can't go on without knowing the size'''
+
+class Unsimulatable(Exception):
+    '''raised where a program can't be run on concretely; stops it'''
+
+def scaleFUnits(value, ppem, unitsPerEm):
+    '''value, in font units, as F26Dot6 pixels at ppem (rounded)'''
+    scaled = (abs(value) * ppem * 64 * 2 + unitsPerEm) // (2 * unitsPerEm)
+    if value < 0:
+        return -scaled
+    return scaled
+
+def roundValue(value, roundState):
+    '''
+    rounds F26Dot6 value like ROUND does in roundState (one of the
+    states RTG, RTHG, RTDG, RDTG, RUTG and ROFF set), keeping its sign;
+    None if the state was set by SROUND or S45ROUND
+    '''
+    if roundState is None:
+        return None
+    magnitude = abs(value)
+    if roundState == 'RTG':
+        rounded = (magnitude + 32) & -64
+    elif roundState == 'RTHG':
+        rounded = (magnitude & -64) + 32
+    elif roundState == 'RTDG':
+        rounded = (magnitude + 16) & -32
+    elif roundState == 'RDTG':
+        rounded = magnitude & -64
+    elif roundState == 'RUTG':
+        rounded = (magnitude + 63) & -64
+    else:
+        rounded = magnitude
+    if value < 0:
+        return -rounded
+    return rounded
+
+class Frame(object):
+    '''where execution is in one body, and how often it's still to run'''
+    def __init__(self, tag, body, position=0, repeats=1):
+        self.tag = tag
+        self.body = body
+        self.position = position
+        self.repeats = repeats
+
+    def copy(self):
+        return Frame(self.tag, self.body, self.position, self.repeats)
+
+class ConcreteState(object):
+    '''
+    The state of the TrueType interpreter at one size (ppem None
+    while the size isn't decided), plus what was seen getting there.
+    '''
+    # instructions a program may execute before it's taken to loop forever
+    MAX_STEPS = 100000
+
+    def __init__(self, bytecodeContainer, unitsPerEm):
+        self.bytecodeContainer = bytecodeContainer
+        self.unitsPerEm = unitsPerEm
+        self.ppem = None
+        self.stack = []
+        # only the entries written so far; the others are the
+        # container's cvt_table scaled to ppem
+        self.cvt = {}
+        self.storage = {}
+        self.loop = 1
+        self.round_state = 'RTG'
+        self.frames = []
+        # instructions executed by the program being run
+        self.steps = 0
+        # IF statement id -> the outcomes seen, 'T' and/or 'F'
+        self.branches = {}
+
+    def copy(self):
+        state = ConcreteState(self.bytecodeContainer, self.unitsPerEm)
+        state.ppem = self.ppem
+        state.stack = list(self.stack)
+        state.cvt = dict(self.cvt)
+        state.storage = dict(self.storage)
+        state.loop = self.loop
+        state.round_state = self.round_state
+        state.frames = [frame.copy() for frame in self.frames]
+        state.steps = self.steps
+        state.branches = dict(self.branches)
+        return state
+
+    def scaledCVT(self):
+        '''the whole CVT, as F26Dot6 pixels'''
+        cvt = {}
+        for index, value in self.bytecodeContainer.cvt_table.items():
+            cvt[index] = scaleFUnits(value, self.ppem, self.unitsPerEm)
+        cvt.update(self.cvt)
+        return cvt
+
+    def pop(self, count=1):
+        if count > len(self.stack):
+            raise Unsimulatable("stack underflow")
+        values = self.stack[len(self.stack)-count:]
+        del self.stack[len(self.stack)-count:]
+        return values
+
+    def pop_known(self, what):
+        value = self.pop()[0]
+        if value is None:
+            raise Unsimulatable("%s depends on the outline" % what)
+        return value
+
+    def start(self, tag, body):
+        '''sets up running body (of program or function tag) from its start'''
+        self.frames = [Frame(tag, body)]
+        self.steps = 0
+
+    def run(self):
+        '''
+        Runs until the program set up with start() ends, or raises
+        NeedsPpem (leaving the state at the instruction needing it).
+        '''
+        while self.frames:
+            frame = self.frames[-1]
+            instructions = frame.body.instructions
+            if frame.position >= len(instructions):
+                frame.repeats -= 1
+                if frame.repeats > 0:
+                    frame.position = 0
+                else:
+                    self.frames.pop()
+                continue
+            statement = instructions[frame.position]
+            self.steps += 1
+            if self.steps > self.MAX_STEPS:
+                raise Unsimulatable("more than %d instructions executed" % self.MAX_STEPS)
+            frame.position = self.step(frame, statement)
+
+    def step(self, frame, statement):
+        '''executes statement; returns the position to go on at in frame.body'''
+        mnemonic = statement.mnemonic
+        body = frame.body
+        position = frame.position
+        if mnemonic == 'PUSH':
+            self.stack.extend(statement.data)
+        elif mnemonic in concreteBinaryOperations:
+            b, a = self.pop(2)
+            result = None
+            if a is not None and b is not None:
+                result = concreteBinaryOperations[mnemonic](b, a)
+            self.stack.append(result)
+        elif mnemonic in ('ABS', 'NOT', 'FLOOR', 'CEILING', 'NEG', 'ROUND', 'ODD', 'EVEN'):
+            value = self.pop()[0]
+            if value is not None:
+                if mnemonic == 'NEG':
+                    value = -value
+                elif mnemonic == 'CEILING':
+                    value = concreteUnaryOperations['ceil'](value)
+                elif mnemonic in ('ROUND', 'ODD', 'EVEN'):
+                    value = roundValue(value, self.round_state)
+                    if value is not None and mnemonic != 'ROUND':
+                        odd = (value & 127) == 64
+                        value = int(odd == (mnemonic == 'ODD'))
+                else:
+                    value = concreteUnaryOperations[mnemonic.lower()](value)
+            self.stack.append(value)
+        elif mnemonic in ('MPPEM', 'MPS'):
+            if self.ppem is None:
+                raise NeedsPpem(mnemonic)
+            self.stack.append(self.ppem)
+        elif mnemonic == 'GETINFO':
+            selector = self.pop_known("GETINFO")
+            info = 0
+            if selector & 1:
+                info |= ENGINE_VERSION
+            if selector & (1 << 5):
+                info |= GRAYSCALE
+            self.stack.append(info)
+        elif mnemonic == 'RCVT':
+            index = self.pop()[0]
+            if index is None:
+                self.stack.append(None)
+            elif index in self.cvt:
+                self.stack.append(self.cvt[index])
+            else:
+                if self.ppem is None:
+                    self.stack.append(index)
+                    raise NeedsPpem(mnemonic)
+                value = self.bytecodeContainer.cvt_table.get(index, 0)
+                self.stack.append(scaleFUnits(value, self.ppem, self.unitsPerEm))
+        elif mnemonic in ('WCVTP', 'WCVTF'):
+            index, value = self.stack[-2:]
+            if mnemonic == 'WCVTF' and value is not None:
+                if self.ppem is None:
+                    raise NeedsPpem(mnemonic)
+                value = scaleFUnits(value, self.ppem, self.unitsPerEm)
+            self.pop(2)
+            if index is None:
+                raise Unsimulatable("%s index depends on the outline" % mnemonic)
+            self.cvt[index] = value
+        elif mnemonic == 'RS':
+            index = self.pop()[0]
+            self.stack.append(None if index is None else self.storage.get(index, 0))
+        elif mnemonic == 'WS':
+            index, value = self.pop(2)
+            if index is None:
+                raise Unsimulatable("WS index depends on the outline")
+            self.storage[index] = value
+        elif mnemonic in ('RTG', 'RTHG', 'RTDG', 'RDTG', 'RUTG', 'ROFF'):
+            self.round_state = mnemonic
+        elif mnemonic in ('SROUND', 'S45ROUND'):
+            self.pop()
+            self.round_state = None
+        elif mnemonic == 'DUP':
+            value = self.pop()[0]
+            self.stack.extend([value, value])
+        elif mnemonic == 'SWAP':
+            self.stack.extend(reversed(self.pop(2)))
+        elif mnemonic == 'ROLL':
+            a, b, c = self.pop(3)
+            self.stack.extend([b, c, a])
+        elif mnemonic in ('CINDEX', 'MINDEX'):
+            index = self.pop_known(mnemonic)
+            if index < 1 or index > len(self.stack):
+                raise Unsimulatable("%s out of the stack" % mnemonic)
+            value = self.stack[-index]
+            if mnemonic == 'MINDEX':
+                del self.stack[-index]
+            self.stack.append(value)
+        elif mnemonic == 'CLEAR':
+            self.stack = []
+        elif mnemonic == 'DEPTH':
+            self.stack.append(len(self.stack))
+        elif mnemonic == 'SLOOP':
+            self.loop = self.pop_known("SLOOP")
+        elif mnemonic in LOOPING:
+            if mnemonic == 'SHPIX':
+                self.pop()
+            self.pop(self.loop)
+            self.loop = 1
+        elif mnemonic.startswith('DELTA'):
+            self.pop(2 * self.pop_known(mnemonic))
+        elif mnemonic == 'IF':
+            condition = self.pop_known("IF condition")
+            self.noteBranch(statement.id, 'T' if condition else 'F')
+            if not condition:
+                return self.positionOf(body, body.branchEnd(statement))
+        elif mnemonic == 'ELSE':
+            # the true branch ran into it
+            return self.positionOf(body, body.branchEnd(statement))
+        elif mnemonic in ('JMPR', 'JROT', 'JROF'):
+            # the offset is on top, as in abstractExecute's execute_jump
+            offset = self.pop_known(mnemonic + " offset")
+            if mnemonic == 'JMPR':
+                taken = True
+            else:
+                condition = self.pop_known(mnemonic + " condition")
+                taken = bool(condition) == (mnemonic == 'JROT')
+            if taken:
+                return self.positionOf(body, body.jumpTarget(statement, offset))
+        elif mnemonic in ('CALL', 'LOOPCALL'):
+            callee = self.pop_known(mnemonic)
+            repeats = 1
+            if mnemonic == 'LOOPCALL':
+                repeats = self.pop_known("LOOPCALL count")
+            function_table = self.bytecodeContainer.function_table
+            if callee not in function_table:
+                raise Unsimulatable("call to undefined function %s" % callee)
+            frame.position = position + 1
+            if repeats > 0:
+                self.frames.append(Frame("fpgm_%s" % callee, function_table[callee].body,
+                                         0, repeats))
+            return frame.position
+        elif mnemonic in ('FDEF', 'IDEF', 'ENDF'):
+            raise Unsimulatable("%s outside of fpgm" % mnemonic)
+        elif mnemonic in stackEffect.stackEffectTable:
+            # graphics state and outline instructions: just their stack effect
+            pops, pushes = stackEffect.stackEffectTable[mnemonic]
+            self.pop(pops)
+            self.stack.extend([None] * pushes)
+        else:
+            raise Unsimulatable("%s isn't simulated" % mnemonic)
+        return position + 1
+
+    def noteBranch(self, id, outcomes):
+        seen = self.branches.get(id, '')
+        if not set(outcomes) <= set(seen):
+            self.branches[id] = ''.join(sorted(set(seen + outcomes)))
+
+    def positionOf(self, body, statement):
+        if statement is None:
+            return len(body.instructions)
+        return body.position(statement)
+
+def runProgram(state, tag):
+    '''
+    Runs program tag in state; returns None, or the error that stopped
+    it (as a string).
+    '''
+    try:
+        state.run()
+    except (Unsimulatable, ProgramError) as e:
+        state.frames = []
+        return "%s: %s" % (tag, e)
+    return None
+
+def simulate(bytecodeContainer, unitsPerEm, ppems, glyphs=()):
+    '''
+    Runs prep, and then each of glyphs (tags) from the state prep left,
+    at each size in ppems. Returns a dict per size: its "ppem", the
+    "cvt" and "storage" prep left, the IF "branches" taken (IF id ->
+    'T', 'F' or 'FT') and the "errors" that stopped programs (tag ->
+    message).
+    '''
+    programs = bytecodeContainer.tag_to_programs
+    shared = ConcreteState(bytecodeContainer, unitsPerEm)
+    prep_error = None
+    if 'prep' in programs:
+        shared.start('prep', programs['prep'].body)
+        try:
+            shared.run()
+        except NeedsPpem:
+            pass
+        except (Unsimulatable, ProgramError) as e:
+            prep_error = "prep: %s" % e
+            shared.frames = []
+
+    results = []
+    for ppem in ppems:
+        state = shared.copy()
+        state.ppem = ppem
+        errors = {}
+        if prep_error is not None:
+            errors['prep'] = prep_error
+        else:
+            error = runProgram(state, 'prep')
+            if error is not None:
+                errors['prep'] = error
+        result = {
+            "ppem": ppem,
+            "cvt": state.scaledCVT(),
+            "storage": dict(state.storage),
+        }
+        for glyph in glyphs:
+            glyph_state = state.copy()
+            glyph_state.stack = []
+            glyph_state.branches = {}
+            glyph_state.start(glyph, programs[glyph].body)
+            error = runProgram(glyph_state, glyph)
+            if error is not None:
+                errors[glyph] = error
+            for id, outcomes in glyph_state.branches.items():
+                state.noteBranch(id, outcomes)
+        result["branches"] = state.branches
+        result["errors"] = errors
+        results.append(result)
+    return results
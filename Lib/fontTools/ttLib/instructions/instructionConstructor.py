@@ -1,4 +1,9 @@
 from . import statements
+from fontTools.ttLib import TTLibError
+from fontTools.ttLib.tables.ttProgram import opcodeDict, streamOpcodeDict, mnemonicDict, streamMnemonicDict, assemblePush
+from fontTools.misc.textTools import num2binary, binary2num
+import array
+import struct
 
 #this will parse str to instruct or data classes
 class instructionConstructor():
@@ -60,4 +65,158 @@ def constructInstructions(program_tag, instructions):
 
     instructions_list.append(thisinstruction)
     return instructions_list
-    
+
+# opcode -> (statement class, argument bits as a binary string or None),
+# i.e. what tokenizer() would make of the disassembled "MNEMONIC[bits]"
+def _makeStatementTable():
+    statementTable = {}
+    for op, (mnemonic, argBits, argoffset) in opcodeDict.items():
+        statementClass = getattr(statements.all, mnemonic + "_Statement")
+        if argBits:
+            statementTable[op] = (statementClass, num2binary(op - argoffset, argBits))
+        else:
+            statementTable[op] = (statementClass, None)
+    return statementTable
+
+statementTable = _makeStatementTable()
+
+# in the compact form, a statement for a run of PUSH instructions
+PUSH_OPCODE = streamMnemonicDict['NPUSHB'][0]
+JUMP_OPCODES = frozenset(mnemonicDict[mnemonic][0] for mnemonic in ('JMPR', 'JROT', 'JROF'))
+
+def decodeBytecode(program_tag, bytecode, operands):
+    '''
+    Decode a bytecode array("B") into the compact form: an array of one
+    opcode per statement and an array of offsets, one per statement plus
+    the end, of the statements' values in operands, an array("i") which
+    may be shared between programs. Consecutive PUSH instructions make
+    one statement, with opcode PUSH_OPCODE, as the disassembler does.
+    Raises TTLibError for an unknown opcode or truncated PUSH data.
+    '''
+    opcodes = array.array("B")
+    offsets = array.array("I")
+    i = 0
+    numBytecode = len(bytecode)
+    while i < numBytecode:
+        op = bytecode[i]
+        offsets.append(len(operands))
+        if op in streamOpcodeDict:
+            opcodes.append(PUSH_OPCODE)
+            while i < numBytecode and bytecode[i] in streamOpcodeDict:
+                start = i
+                op = bytecode[i]
+                mnemonic, argBits, argoffset = streamOpcodeDict[op]
+                if argBits:
+                    nValues = op - argoffset + 1
+                else:
+                    i = i + 1
+                    if i == numBytecode:
+                        raise TTLibError("%s: %s at byte %d has no count"
+                                         % (program_tag, mnemonic, start))
+                    nValues = bytecode[i]
+                i = i + 1
+                nBytes = nValues * 2 if mnemonic[-1] == "W" else nValues
+                if i + nBytes > numBytecode:
+                    raise TTLibError("%s: %s at byte %d pushes %d bytes, only %d left"
+                                     % (program_tag, mnemonic, start, nBytes, numBytecode - i))
+                if mnemonic[-1] == "W":
+                    operands.extend(struct.unpack(">%dh" % nValues, bytecode[i:i+2*nValues].tostring()))
+                    i = i + 2*nValues
+                else:
+                    operands.extend(bytecode[i:i+nValues].tolist())
+                    i = i + nValues
+        else:
+            if op not in statementTable:
+                raise TTLibError("%s: unknown opcode 0x%02X at byte %d" % (program_tag, op, i))
+            opcodes.append(op)
+            i = i + 1
+    offsets.append(len(operands))
+    return opcodes, offsets
+
+def constructStatements(program_tag, opcodes, offsets, operands, start=0, end=None):
+    '''
+    Make the statements for opcodes[start:end] of a program in compact
+    form, numbered from start.
+    '''
+    if end is None:
+        end = len(opcodes)
+    instructions_list = []
+    for number in range(start, end):
+        op = opcodes[number]
+        if op == PUSH_OPCODE:
+            thisinstruction = statements.all.PUSH_Statement()
+            thisinstruction.data.extend(operands[offsets[number]:offsets[number+1]])
+        else:
+            statementClass, arg = statementTable[op]
+            thisinstruction = statementClass()
+            if arg is not None:
+                thisinstruction.data.append(arg)
+        thisinstruction.id = program_tag + '.' + str(number)
+        instructions_list.append(thisinstruction)
+    return instructions_list
+
+class CompactInstructions(object):
+    '''
+    Statements start to end of a program in compact form (see
+    decodeBytecode), which are only made when asked for.
+    '''
+    def __init__(self, program_tag, opcodes, offsets, operands, start=0, end=None):
+        self.program_tag = program_tag
+        self.opcodes = opcodes
+        self.offsets = offsets
+        self.operands = operands
+        self.start = start
+        if end is None:
+            end = len(opcodes)
+        self.end = end
+    def __len__(self):
+        return self.end - self.start
+    def opcode(self, index):
+        return self.opcodes[self.start + index]
+    def values(self, index):
+        index = self.start + index
+        return self.operands[self.offsets[index]:self.offsets[index+1]].tolist()
+    def slice(self, start, end):
+        return CompactInstructions(self.program_tag, self.opcodes, self.offsets, self.operands,
+                                   self.start + start, self.start + end)
+    def hasJumps(self):
+        for index in range(self.start, self.end):
+            if self.opcodes[index] in JUMP_OPCODES:
+                return True
+        return False
+    def statements(self):
+        return constructStatements(self.program_tag, self.opcodes, self.offsets, self.operands,
+                                   self.start, self.end)
+    def assemble(self, push):
+        '''calls push with each byte of the bytecode of these statements'''
+        for index in range(self.start, self.end):
+            op = self.opcodes[index]
+            if op == PUSH_OPCODE:
+                assemblePush(self.operands[self.offsets[index]:self.offsets[index+1]].tolist(), push)
+            else:
+                push(op)
+
+def assembleStatements(instructions, push):
+    '''
+    Calls push with each byte of the bytecode of a list of statements,
+    writing each PUSH_Statement with the most compact PUSH instructions.
+    '''
+    for instruction in instructions:
+        if instruction.mnemonic == 'PUSH':
+            assemblePush(list(instruction.data), push)
+            continue
+        op, argBits = mnemonicDict[instruction.mnemonic]
+        bits = ''.join(str(data) for data in instruction.data)
+        if bits:
+            op = op + binary2num(bits)
+        push(op)
+
+def constructInstructionsFromBytecode(program_tag, bytecode):
+    '''
+    Decode a bytecode array("B") straight into a list of statements, without
+    going through getAssembly() and the tokenizer. Consecutive PUSH
+    instructions are merged into one PUSH_Statement, as the disassembler does.
+    '''
+    operands = array.array("i")
+    opcodes, offsets = decodeBytecode(program_tag, bytecode, operands)
+    return constructStatements(program_tag, opcodes, offsets, operands)
@@ -0,0 +1,249 @@
+'''
+Static stack effects of the TrueType instructions, and a dataflow pass
+computing the maximum stack depth of programs from them without
+abstractly executing the programs.
+
+Most instructions pop and push a fixed number of values (see the
+push_num/pop_num of the statement classes). The pass only tracks which
+values on the stack are constants pushed by PUSH, which is what the
+instructions whose effect depends on the stack (CALL, LOOPCALL, SLOOP
+and the loop-counted and DELTA instructions) need to know. Anything it
+can't follow statically (jumps, unknown callees or counts, branches
+leaving different depths) raises StaticAnalysisUnsupported, on which
+maximumStackDepth gives up.
+'''
+import statements
+
+# stack effects that can't be read off the statement classes
+DYNAMIC = frozenset(['CALL', 'LOOPCALL', 'SLOOP', 'CLEAR', 'DEPTH',
+                     'ALIGNRP', 'FLIPPT', 'IP', 'SHP', 'SHPIX',
+                     'DELTAP1', 'DELTAP2', 'DELTAP3', 'DELTAC1', 'DELTAC2', 'DELTAC3',
+                     'JMPR', 'JROT', 'JROF'])
+# these move values around, which the pass follows exactly
+PERMUTATIONS = frozenset(['DUP', 'SWAP', 'ROLL', 'CINDEX', 'MINDEX'])
+BRANCHES = frozenset(['IF', 'ELSE', 'EIF'])
+
+class StaticAnalysisUnsupported(Exception):
+    '''raised where the pass can't follow a program statically'''
+
+def _makeStackEffectTable():
+    table = {}
+    for name in dir(statements.all):
+        if not name.endswith('_Statement') or name == 'PUSH_Statement':
+            continue
+        statement = getattr(statements.all, name)()
+        if statement.mnemonic not in DYNAMIC:
+            table[statement.mnemonic] = (statement.pop_num, statement.push_num)
+    return table
+
+# mnemonic -> (values popped, values pushed), for the fixed ones
+stackEffectTable = _makeStackEffectTable()
+
+class Segment(object):
+    '''
+    The effect of a run of instructions with fixed stack effects: it
+    takes 'dip' values off the stack it starts on, leaves 'pushed' on
+    top of it (constants, or None), and reaches 'peak' values above
+    that stack at its highest.
+    '''
+    def __init__(self):
+        self.dip = 0
+        self.pushed = []
+        self.peak = 0
+
+    def add(self, statement):
+        if statement.mnemonic == 'PUSH':
+            self.pushed.extend(statement.data)
+        else:
+            pops, pushes = stackEffectTable[statement.mnemonic]
+            if pops > len(self.pushed):
+                self.dip += pops - len(self.pushed)
+                self.pushed = []
+            elif pops > 0:
+                del self.pushed[-pops:]
+            self.pushed.extend([None] * pushes)
+        self.peak = max(self.peak, len(self.pushed) - self.dip)
+
+def summarizeBody(instructions):
+    '''
+    Folds the runs of fixed-effect instructions of a body into
+    Segments; the other statements stay as they are. Returns the items
+    and, for the index of every IF item, the indices of its ELSE (or
+    None) and EIF items.
+    '''
+    items = []
+    branches = {}
+    open_ifs = []
+    segment = None
+    for statement in instructions:
+        if (statement.mnemonic == 'PUSH' or
+            statement.mnemonic in stackEffectTable and
+            statement.mnemonic not in PERMUTATIONS and
+            statement.mnemonic not in BRANCHES):
+            if segment is None:
+                segment = Segment()
+                items.append(segment)
+            segment.add(statement)
+            continue
+        segment = None
+        if statement.mnemonic == 'IF':
+            open_ifs.append(len(items))
+            branches[len(items)] = [None, None]
+        elif statement.mnemonic == 'ELSE':
+            branches[open_ifs[-1]][0] = len(items)
+        elif statement.mnemonic == 'EIF':
+            branches[open_ifs.pop()][1] = len(items)
+        items.append(statement)
+    return items, branches
+
+class StackState(object):
+    '''What the pass knows at a point of a program.'''
+    def __init__(self, stack=None, loop=1):
+        if stack is None:
+            stack = []
+        # the stack, with the values that are known constants
+        self.stack = stack
+        # the loop graphics state variable, or None if unknown
+        self.loop = loop
+
+    def copy(self):
+        return StackState(list(self.stack), self.loop)
+
+    def pop(self, count=1):
+        if count > len(self.stack):
+            raise StaticAnalysisUnsupported("stack underflow")
+        values = self.stack[len(self.stack)-count:]
+        del self.stack[len(self.stack)-count:]
+        return values
+
+    def pop_known(self):
+        value = self.pop()[0]
+        if value is None:
+            raise StaticAnalysisUnsupported("value needed isn't a constant")
+        return value
+
+    def merge(self, other):
+        if len(self.stack) != len(other.stack):
+            raise StaticAnalysisUnsupported("branches leave different stack depths")
+        self.stack = [v if v == w else None for v, w in zip(self.stack, other.stack)]
+        if self.loop != other.loop:
+            self.loop = None
+
+class StackDepthPass(object):
+    '''
+    Runs programs of a BytecodeContainer over StackStates, keeping
+    track of the highest the stack gets.
+    '''
+    def __init__(self, bytecodeContainer):
+        self.bytecodeContainer = bytecodeContainer
+        self.maximum_stack_depth = 0
+        self.active_functions = set()
+
+    def run_body(self, body, state):
+        if body.has_jumps:
+            raise StaticAnalysisUnsupported("jumps")
+        items, branches = body.stackSummary()
+        return self.run_items(items, branches, 0, len(items), state)
+
+    def run_items(self, items, branches, start, end, state):
+        index = start
+        while index < end:
+            item = items[index]
+            if isinstance(item, Segment):
+                if item.dip > len(state.stack):
+                    raise StaticAnalysisUnsupported("stack underflow")
+                self.note_depth(len(state.stack) + item.peak)
+                del state.stack[len(state.stack)-item.dip:]
+                state.stack.extend(item.pushed)
+            elif item.mnemonic == 'IF':
+                state.pop()
+                else_index, eif_index = branches[index]
+                if else_index is None:
+                    then_state = self.run_items(items, branches, index+1, eif_index, state.copy())
+                else:
+                    then_state = self.run_items(items, branches, index+1, else_index, state.copy())
+                    state = self.run_items(items, branches, else_index+1, eif_index, state)
+                state.merge(then_state)
+                index = eif_index
+            elif item.mnemonic != 'EIF':
+                state = self.run_statement(item, state)
+            index += 1
+        return state
+
+    def run_statement(self, statement, state):
+        mnemonic = statement.mnemonic
+        if mnemonic == 'CALL':
+            return self.run_function(state.pop_known(), state)
+        elif mnemonic == 'LOOPCALL':
+            callee = state.pop_known()
+            count = state.pop_known()
+            for i in range(count):
+                state = self.run_function(callee, state)
+            return state
+        elif mnemonic == 'SLOOP':
+            state.loop = state.pop()[0]
+        elif mnemonic == 'CLEAR':
+            state.stack = []
+        elif mnemonic == 'DEPTH':
+            state.stack.append(len(state.stack))
+        elif mnemonic in ('ALIGNRP', 'FLIPPT', 'IP', 'SHP', 'SHPIX'):
+            if mnemonic == 'SHPIX':
+                state.pop()
+            if state.loop is None:
+                raise StaticAnalysisUnsupported("loop count isn't a constant")
+            state.pop(state.loop)
+            state.loop = 1
+        elif mnemonic.startswith('DELTA'):
+            state.pop(2 * state.pop_known())
+        elif mnemonic == 'DUP':
+            state.stack.append(state.pop()[0])
+            state.stack.append(state.stack[-1])
+        elif mnemonic == 'SWAP':
+            state.stack.extend(reversed(state.pop(2)))
+        elif mnemonic == 'ROLL':
+            a, b, c = state.pop(3)
+            state.stack.extend([b, c, a])
+        elif mnemonic in ('CINDEX', 'MINDEX'):
+            index = state.pop_known()
+            if index < 1 or index > len(state.stack):
+                raise StaticAnalysisUnsupported("%s out of the stack" % mnemonic)
+            value = state.stack[-index]
+            if mnemonic == 'MINDEX':
+                del state.stack[-index]
+            state.stack.append(value)
+        else:
+            # the jumps
+            raise StaticAnalysisUnsupported(mnemonic)
+        self.note_depth(len(state.stack))
+        return state
+
+    def run_function(self, callee, state):
+        function_table = self.bytecodeContainer.function_table
+        if callee not in function_table or callee in self.active_functions:
+            raise StaticAnalysisUnsupported("call to function %s" % callee)
+        self.active_functions.add(callee)
+        state = self.run_body(function_table[callee].body, state)
+        self.active_functions.remove(callee)
+        return state
+
+    def note_depth(self, depth):
+        if depth > self.maximum_stack_depth:
+            self.maximum_stack_depth = depth
+
+def maximumStackDepth(bytecodeContainer, glyphs):
+    '''
+    The maximum stack depth reached running prep and then each of
+    'glyphs' (tags), or None if some program can't be followed
+    statically; abstract execution (see abstractExecute) can always
+    tell.
+    '''
+    depthPass = StackDepthPass(bytecodeContainer)
+    try:
+        state = StackState()
+        if 'prep' in bytecodeContainer.tag_to_programs:
+            state = depthPass.run_body(bytecodeContainer.tag_to_programs['prep'].body, state)
+        for glyph in glyphs:
+            depthPass.run_body(bytecodeContainer.tag_to_programs[glyph].body, state.copy())
+    except StaticAnalysisUnsupported:
+        return None
+    return depthPass.maximum_stack_depth
@@ -1,8 +1,9 @@
 """ttLib/sfnt.py -- low-level module to deal with the sfnt file format.
 
-Defines two public classes:
+Defines three public classes:
 	SFNTReader
 	SFNTWriter
+	TTCWriter
 
 (Normally you don't have to use these classes explicitly; they are 
 used automatically by ttLib.TTFont.)
@@ -17,6 +18,33 @@ from fontTools.misc.py23 import *
 from fontTools.misc import sstruct
 from fontTools.ttLib import getSearchRange
 import struct
+try:
+	import mmap
+except ImportError:
+	mmap = None
+
+# tableView(data, offset, size): a read-only view of size bytes of data
+# from offset, sharing its memory
+try:
+	tableView = buffer
+except NameError:
+	def tableView(data, offset, size):
+		return memoryview(data)[offset:offset+size]
+
+
+def mapFile(file):
+	"""A read-only mmap of the whole of file, or None if it can't be
+	mapped (it isn't a real file, or it's empty, say)."""
+	if mmap is None:
+		return None
+	try:
+		fileno = file.fileno()
+	except (AttributeError, IOError, ValueError):
+		return None
+	try:
+		return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+	except (EnvironmentError, ValueError):
+		return None
 
 
 class SFNTReader(object):
@@ -24,6 +52,9 @@ class SFNTReader(object):
 	def __init__(self, file, checkChecksums=1, fontNumber=-1):
 		self.file = file
 		self.checkChecksums = checkChecksums
+		# table data is read from this map of the file when it could be
+		# mapped: the pages are shared with the OS cache and other readers
+		self.map = mapFile(file)
 
 		self.flavor = None
 		self.flavorData = None
@@ -73,7 +104,7 @@ class SFNTReader(object):
 	def __getitem__(self, tag):
 		"""Fetch the raw table data."""
 		entry = self.tables[Tag(tag)]
-		data = entry.loadData (self.file)
+		data = entry.loadData (self.file, self.map)
 		if self.checkChecksums:
 			if tag == 'head':
 				# Beh: we have to special-case the 'head' table.
@@ -88,10 +119,25 @@ class SFNTReader(object):
 				print("bad checksum for '%s' table" % tag)
 		return data
 	
+	def view(self, tag):
+		"""Fetch the raw table data as a read-only buffer: for tables
+		stored as is in a mapped file, a view of the map rather than a
+		copy. Checksums aren't checked."""
+		return self.tables[Tag(tag)].loadView(self.file, self.map)
+
 	def __delitem__(self, tag):
 		del self.tables[Tag(tag)]
+
+	def unmap(self):
+		"""Stop reading from the map of the file (views of it must not be
+		used any more), e.g. before the file is overwritten: accessing a
+		map of a truncated file kills the process."""
+		if self.map is not None:
+			self.map.close()
+			self.map = None
 	
 	def close(self):
+		self.unmap()
 		self.file.close()
 
 
@@ -268,6 +314,70 @@ class SFNTWriter(object):
 		self.file.write(struct.pack(">L", checksumadjustment))
 
 
+class TTCWriter(object):
+
+	"""Writes a TrueType Collection from the raw table data of its fonts.
+	Tables with the same tag and data are stored once, and shared by all
+	the fonts that have them.
+	"""
+
+	def __init__(self, file):
+		self.file = file
+		self.fonts = []
+
+	def addFont(self, tables, sfntVersion="\000\001\000\000"):
+		"""Add a font; 'tables' maps tags to raw table data."""
+		self.fonts.append((Tag(sfntVersion), tables))
+
+	def close(self):
+		numFonts = len(self.fonts)
+		offset = ttcHeaderSize + 4 * numFonts
+		fontOffsets = []
+		for sfntVersion, tables in self.fonts:
+			fontOffsets.append(offset)
+			offset = offset + sfntDirectorySize + len(tables) * sfntDirectoryEntrySize
+
+		# lay out the table data, once per distinct (tag, data)
+		stored = {}
+		tableData = []
+		directories = []
+		for sfntVersion, tables in self.fonts:
+			entries = []
+			for tag, data in sorted(tables.items()):
+				key = (tag, data)
+				if key not in stored:
+					entry = SFNTDirectoryEntry()
+					entry.tag = Tag(tag)
+					if tag == 'head':
+						# there's no sensible checkSumAdjustment for a
+						# head shared between fonts; it is kept as is
+						entry.checkSum = calcChecksum(data[:8] + b'\0\0\0\0' + data[12:])
+					else:
+						entry.checkSum = calcChecksum(data)
+					entry.offset = offset
+					entry.length = len(data)
+					stored[key] = entry
+					tableData.append(data)
+					offset = offset + ((entry.length + 3) & ~3)
+				entries.append(stored[key])
+			searchRange, entrySelector, rangeShift = getSearchRange(len(entries), 16)
+			directory = sstruct.pack(sfntDirectoryFormat, dict(sfntVersion=sfntVersion,
+				numTables=len(entries), searchRange=searchRange,
+				entrySelector=entrySelector, rangeShift=rangeShift))
+			for entry in entries:
+				directory = directory + entry.toString()
+			directories.append(directory)
+
+		header = dict(TTCTag=b"ttcf", Version=0x00010000, numFonts=numFonts)
+		self.file.write(sstruct.pack(ttcHeaderFormat, header))
+		self.file.write(struct.pack(">%dL" % numFonts, *fontOffsets))
+		for directory in directories:
+			self.file.write(directory)
+		for data in tableData:
+			self.file.write(data)
+			self.file.write(b'\0' * (((len(data) + 3) & ~3) - len(data)))
+
+
 # -- sfnt directory helpers and cruft
 
 ttcHeaderFormat = """
@@ -355,14 +465,23 @@ class DirectoryEntry(object):
 		else:
 			return "<%s at %x>" % (self.__class__.__name__, id(self))
 
-	def loadData(self, file):
-		file.seek(self.offset)
-		data = file.read(self.length)
+	def loadData(self, file, map=None):
+		if map is not None:
+			data = map[self.offset:self.offset+self.length]
+		else:
+			file.seek(self.offset)
+			data = file.read(self.length)
 		assert len(data) == self.length
 		if hasattr(self.__class__, 'decodeData'):
 			data = self.decodeData(data)
 		return data
 
+	def loadView(self, file, map=None):
+		if map is None:
+			return self.loadData(file)
+		assert self.offset + self.length <= len(map)
+		return tableView(map, self.offset, self.length)
+
 	def saveData(self, file, data):
 		if hasattr(self.__class__, 'encodeData'):
 			data = self.encodeData(data)
@@ -386,6 +505,14 @@ class WOFFDirectoryEntry(DirectoryEntry):
 	format = woffDirectoryEntryFormat
 	formatSize = woffDirectoryEntrySize
 	zlibCompressionLevel = 6
+	# the decompressed data, once loadView needed it
+	decodedData = None
+
+	def loadView(self, file, map=None):
+		# decompressed once, into a buffer of its own
+		if self.decodedData is None:
+			self.decodedData = self.loadData(file, map)
+		return self.decodedData
 
 	def decodeData(self, rawData):
 		import zlib
@@ -5,6 +5,14 @@ from fontTools.ttLib import getClassTag
 class DefaultTable(object):
 	
 	dependencies = []
+	# Whether the table may differ from its data in the font file. Only
+	# the caller can tell that a decompiled table wasn't changed (edits
+	# deep inside it, to a name record or a glyph, say, can't be seen),
+	# by clearing it; TTFont.save(reuseUnmodified=True) then copies the
+	# table from the file. Whoever changes the table afterwards sets it
+	# again, as changing the glyphs of glyf or the metrics of hmtx/vmtx
+	# does.
+	dirty = True
 	
 	def __init__(self, tag=None):
 		if tag is None:
@@ -44,4 +52,4 @@ class DefaultTable(object):
 	def __eq__(self, other):
 		if type(self) != type(other):
 			return NotImplemented
-		return self.__dict__ == other.__dict__
+		return dict(self.__dict__, dirty=None) == dict(other.__dict__, dirty=None)
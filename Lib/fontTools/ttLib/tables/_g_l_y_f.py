@@ -15,6 +15,10 @@ import sys
 import struct
 import array
 import warnings
+try:
+	from collections.abc import MutableMapping
+except ImportError:
+	from collections import MutableMapping
 
 #
 # The Apple and MS rasterizers behave differently for 
@@ -33,6 +37,9 @@ class table__g_l_y_f(DefaultTable.DefaultTable):
 	
 	def decompile(self, data, ttFont):
 		loca = ttFont['loca']
+		if ttFont.lazy is True:
+			self.decompileLazily(data, ttFont)
+			return
 		last = int(loca[0])
 		noname = 0
 		self.glyphs = {}
@@ -58,6 +65,21 @@ class table__g_l_y_f(DefaultTable.DefaultTable):
 		if ttFont.lazy is False: # Be lazy for None and True
 			for glyph in self.glyphs.values():
 				glyph.expand(self)
+
+	def decompileLazily(self, data, ttFont):
+		loca = ttFont['loca']
+		self.glyphOrder = glyphOrder = ttFont.getGlyphOrder()
+		numGlyphs = len(loca) - 1
+		names = list(glyphOrder[:numGlyphs])
+		if len(names) < numGlyphs:
+			warnings.warn('%s glyphs have no name' % (numGlyphs - len(names)))
+			names.extend('ttxautoglyph%s' % i for i in range(len(names), numGlyphs))
+		if numGlyphs > 0 and int(loca[numGlyphs]) > len(data):
+			raise ttLib.TTLibError("not enough 'glyf' table data")
+		if numGlyphs > 0 and len(data) - int(loca[numGlyphs]) >= 4:
+			warnings.warn("too much 'glyf' table data: expected %d, received %d bytes" %
+					(int(loca[numGlyphs]), len(data)))
+		self.glyphs = LazyGlyphs(data, loca, names, self)
 	
 	def compile(self, ttFont):
 		if not hasattr(self, "glyphOrder"):
@@ -176,16 +198,91 @@ class table__g_l_y_f(DefaultTable.DefaultTable):
 		self.glyphs[glyphName] = glyph
 		if glyphName not in self.glyphOrder:
 			self.glyphOrder.append(glyphName)
+		self.dirty = True
 	
 	def __delitem__(self, glyphName):
 		del self.glyphs[glyphName]
 		self.glyphOrder.remove(glyphName)
+		self.dirty = True
 	
 	def __len__(self):
 		assert len(self.glyphOrder) == len(self.glyphs)
 		return len(self.glyphs)
 
 
+class LazyGlyphs(MutableMapping):
+
+	"""The glyphs of a glyf table decompiled by a TTFont(lazy=True): the
+	Glyph of a glyph is only made, from its slice of the table data, the
+	first time it is looked up."""
+
+	def __init__(self, data, loca, names, table=None):
+		self.data = data
+		# the table made dirty by changes to the glyphs
+		self.table = table
+		self.loca = loca
+		# the glyph names, in the order of loca
+		self.names = names
+		# glyph name -> index in loca, made on the first lookup
+		self.indices = None
+		# the Glyphs made or set so far
+		self.glyphs = {}
+		# glyphs of names that were deleted
+		self.deleted = set()
+
+	def getIndices(self):
+		if self.indices is None:
+			self.indices = dict((name, i) for i, name in enumerate(self.names))
+		return self.indices
+
+	def __getitem__(self, glyphName):
+		if glyphName in self.glyphs:
+			return self.glyphs[glyphName]
+		if glyphName in self.deleted:
+			raise KeyError(glyphName)
+		i = self.getIndices()[glyphName]
+		glyph = Glyph(self.data[int(self.loca[i]):int(self.loca[i+1])])
+		self.glyphs[glyphName] = glyph
+		return glyph
+
+	def setDirty(self):
+		if self.table is not None:
+			self.table.dirty = True
+
+	def __setitem__(self, glyphName, glyph):
+		self.setDirty()
+		self.glyphs[glyphName] = glyph
+		self.deleted.discard(glyphName)
+
+	def __delitem__(self, glyphName):
+		if glyphName not in self:
+			raise KeyError(glyphName)
+		self.setDirty()
+		self.glyphs.pop(glyphName, None)
+		if glyphName in self.getIndices():
+			self.deleted.add(glyphName)
+
+	def __contains__(self, glyphName):
+		return glyphName in self.glyphs or (glyphName in self.getIndices() and
+		                                    glyphName not in self.deleted)
+
+	has_key = __contains__
+
+	def __iter__(self):
+		for glyphName in self.names:
+			if glyphName not in self.deleted:
+				yield glyphName
+		indices = self.getIndices()
+		for glyphName in self.glyphs:
+			if glyphName not in indices:
+				yield glyphName
+
+	def __len__(self):
+		indices = self.getIndices()
+		added = sum(1 for glyphName in self.glyphs if glyphName not in indices)
+		return len(self.names) - len(self.deleted) + added
+
+
 glyphHeaderFormat = """
 		>	# big endian
 		numberOfContours:	h
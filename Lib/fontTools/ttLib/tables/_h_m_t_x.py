@@ -5,6 +5,10 @@ from . import DefaultTable
 import sys
 import array
 import warnings
+try:
+	from collections.abc import MutableMapping
+except ImportError:
+	from collections import MutableMapping
 
 
 class table__h_m_t_x(DefaultTable.DefaultTable):
@@ -32,42 +36,36 @@ class table__h_m_t_x(DefaultTable.DefaultTable):
 			sideBearings.byteswap()
 		if data:
 			warnings.warn("too much 'hmtx'/'vmtx' table data")
-		self.metrics = {}
+		advances = metrics[0::2]
+		advances.extend(array.array("h", metrics[-2:-1]) * numberOfSideBearings)
+		allSideBearings = metrics[1::2]
+		allSideBearings.extend(sideBearings)
 		glyphOrder = ttFont.getGlyphOrder()
-		for i in range(numberOfMetrics):
-			glyphName = glyphOrder[i]
-			self.metrics[glyphName] = list(metrics[i*2:i*2+2])
-		lastAdvance = metrics[-2]
-		for i in range(numberOfSideBearings):
-			glyphName = glyphOrder[i + numberOfMetrics]
-			self.metrics[glyphName] = [lastAdvance, sideBearings[i]]
+		self.metrics = Metrics(glyphOrder[:numGlyphs], advances, allSideBearings, self)
 	
 	def compile(self, ttFont):
-		metrics = []
-		for glyphName in ttFont.getGlyphOrder():
-			metrics.append(self.metrics[glyphName])
-		lastAdvance = metrics[-1][0]
-		lastIndex = len(metrics)
-		while metrics[lastIndex-2][0] == lastAdvance:
+		glyphOrder = ttFont.getGlyphOrder()
+		if isinstance(self.metrics, Metrics) and self.metrics.isIndexedBy(glyphOrder):
+			advances = self.metrics.advances
+			sideBearings = self.metrics.sideBearings
+		else:
+			metrics = [self.metrics[glyphName] for glyphName in glyphOrder]
+			advances = array.array("h", [advance for advance, sb in metrics])
+			sideBearings = array.array("h", [sb for advance, sb in metrics])
+		lastAdvance = advances[-1]
+		lastIndex = len(advances)
+		while lastIndex > 1 and advances[lastIndex-2] == lastAdvance:
 			lastIndex -= 1
-			if lastIndex <= 1:
-				# all advances are equal
-				lastIndex = 1
-				break
-		additionalMetrics = metrics[lastIndex:]
-		additionalMetrics = [sb for advance, sb in additionalMetrics]
-		metrics = metrics[:lastIndex]
-		setattr(ttFont[self.headerTag], self.numberOfMetricsName, len(metrics))
+		setattr(ttFont[self.headerTag], self.numberOfMetricsName, lastIndex)
 		
-		allMetrics = []
-		for item in metrics:
-			allMetrics.extend(item)
-		allMetrics = array.array("h", allMetrics)
+		allMetrics = array.array("h", [0]) * (2 * lastIndex)
+		allMetrics[0::2] = advances[:lastIndex]
+		allMetrics[1::2] = sideBearings[:lastIndex]
 		if sys.byteorder != "big":
 			allMetrics.byteswap()
 		data = allMetrics.tostring()
 		
-		additionalMetrics = array.array("h", additionalMetrics)
+		additionalMetrics = sideBearings[lastIndex:]
 		if sys.byteorder != "big":
 			additionalMetrics.byteswap()
 		data = data + additionalMetrics.tostring()
@@ -93,10 +91,110 @@ class table__h_m_t_x(DefaultTable.DefaultTable):
 
 	def __delitem__(self, glyphName):
 		del self.metrics[glyphName]
+		self.dirty = True
 	
 	def __getitem__(self, glyphName):
 		return self.metrics[glyphName]
 	
 	def __setitem__(self, glyphName, advance_sb_pair):
 		self.metrics[glyphName] = tuple(advance_sb_pair)
+		self.dirty = True
+
+
+
+class Metrics(MutableMapping):
+
+	"""The metrics of a decompiled hmtx or vmtx table, in arrays indexed
+	by glyph ID. Looked up by glyph name, they are [advance, side
+	bearing] lists, as in the dict fromXML makes; changing one of these
+	changes the metrics."""
+
+	def __init__(self, names, advances, sideBearings, table=None):
+		# the glyph names, in the order of the arrays
+		self.names = names
+		# the table made dirty by changes to the metrics
+		self.table = table
+		self.advances = advances
+		self.sideBearings = sideBearings
+		# glyph name -> glyph ID, made on the first lookup
+		self.indices = None
+		# metrics of glyphs that aren't in names
+		self.extra = {}
+		# glyphs of names that were deleted
+		self.deleted = set()
+
+	def getIndices(self):
+		if self.indices is None:
+			self.indices = dict((name, i) for i, name in enumerate(self.names))
+		return self.indices
+
+	def isIndexedBy(self, glyphOrder):
+		"""Whether the arrays are the metrics of glyphOrder, as they are."""
+		return not self.extra and not self.deleted and self.names == glyphOrder
+
+	def __getitem__(self, glyphName):
+		if glyphName in self.extra:
+			return self.extra[glyphName]
+		if glyphName in self.deleted:
+			raise KeyError(glyphName)
+		i = self.getIndices()[glyphName]
+		return MetricsPair(self, glyphName, (self.advances[i], self.sideBearings[i]))
+
+	def setDirty(self):
+		if self.table is not None:
+			self.table.dirty = True
+
+	def __setitem__(self, glyphName, advance_sb_pair):
+		self.setDirty()
+		advance, sb = advance_sb_pair
+		i = self.getIndices().get(glyphName)
+		if i is None:
+			self.extra[glyphName] = [advance, sb]
+			return
+		self.advances[i] = advance
+		self.sideBearings[i] = sb
+		self.deleted.discard(glyphName)
+
+	def __delitem__(self, glyphName):
+		self.setDirty()
+		if glyphName in self.extra:
+			del self.extra[glyphName]
+		elif glyphName in self.getIndices() and glyphName not in self.deleted:
+			self.deleted.add(glyphName)
+		else:
+			raise KeyError(glyphName)
+
+	def __contains__(self, glyphName):
+		return glyphName in self.extra or (glyphName in self.getIndices() and
+		                                   glyphName not in self.deleted)
+
+	has_key = __contains__
+
+	def __iter__(self):
+		for glyphName in self.names:
+			if glyphName not in self.deleted:
+				yield glyphName
+		for glyphName in self.extra:
+			yield glyphName
+
+	def __len__(self):
+		return len(self.names) - len(self.deleted) + len(self.extra)
+
+
+class MetricsPair(list):
+
+	"""The [advance, side bearing] of a glyph of a Metrics, which are
+	written back to it when changed."""
+
+	def __init__(self, metrics, glyphName, pair):
+		list.__init__(self, pair)
+		self.metrics = metrics
+		self.glyphName = glyphName
+
+	def __setitem__(self, index, value):
+		list.__setitem__(self, index, value)
+		self.metrics[self.glyphName] = self
 
+	def __setslice__(self, i, j, sequence):
+		list.__setslice__(self, i, j, sequence)
+		self.metrics[self.glyphName] = self
@@ -223,6 +223,57 @@ _whiteRE = re.compile(r"\s*")
 _pushCountPat = re.compile(r"[A-Z][A-Z0-9]*\s*\[.*?\]\s*/\* ([0-9]*).*?\*/")
 
 
+def assemblePush(args, push):
+        """Calls push with the bytes of the most compact PUSH instructions for args."""
+        nArgs = len(args)
+        # Automatically choose the most compact representation
+        nWords = 0
+        while nArgs:
+                while nWords < nArgs and nWords < 255 and not (0 <= args[nWords] <= 255):
+                        nWords += 1
+                nBytes = 0
+                while nWords+nBytes < nArgs and nBytes < 255 and 0 <= args[nWords+nBytes] <= 255:
+                        nBytes += 1
+                if nBytes < 2 and nWords + nBytes < 255 and nWords + nBytes != nArgs:
+                        # Will write bytes as words
+                        nWords += nBytes
+                        continue
+
+                # Write words
+                if nWords:
+                        if nWords <= 8:
+                                op, argBits = streamMnemonicDict["PUSHW"]
+                                op = op + nWords - 1
+                                push(op)
+                        else:
+                                op, argBits = streamMnemonicDict["NPUSHW"]
+                                push(op)
+                                push(nWords)
+                        for value in args[:nWords]:
+                                assert -32768 <= value < 32768, "PUSH value out of range %d" % value
+                                push((value >> 8) & 0xff)
+                                push(value & 0xff)
+
+                # Write bytes
+                if nBytes:
+                        pass
+                        if nBytes <= 8:
+                                op, argBits = streamMnemonicDict["PUSHB"]
+                                op = op + nBytes - 1
+                                push(op)
+                        else:
+                                op, argBits = streamMnemonicDict["NPUSHB"]
+                                push(op)
+                                push(nBytes)
+                        for value in args[nWords:nWords+nBytes]:
+                                push(value)
+
+                nTotal = nWords + nBytes
+                args = args[nTotal:]
+                nArgs -= nTotal
+                nWords = 0
+
+
 def _skipWhite(data, pos):
         m = _whiteRE.match(data, pos)
         newPos = m.regs[0][1]
@@ -345,52 +396,7 @@ class Program(object):
                                         args.append(int(number))
                                 nArgs = len(args)
                                 if mnemonic == "PUSH":
-                                        # Automatically choose the most compact representation
-                                        nWords = 0
-                                        while nArgs:
-                                                while nWords < nArgs and nWords < 255 and not (0 <= args[nWords] <= 255):
-                                                        nWords += 1
-                                                nBytes = 0
-                                                while nWords+nBytes < nArgs and nBytes < 255 and 0 <= args[nWords+nBytes] <= 255:
-                                                        nBytes += 1
-                                                if nBytes < 2 and nWords + nBytes < 255 and nWords + nBytes != nArgs:
-                                                        # Will write bytes as words
-                                                        nWords += nBytes
-                                                        continue
-
-                                                # Write words
-                                                if nWords:
-                                                        if nWords <= 8:
-                                                                op, argBits = streamMnemonicDict["PUSHW"]
-                                                                op = op + nWords - 1
-                                                                push(op)
-                                                        else:
-                                                                op, argBits = streamMnemonicDict["NPUSHW"]
-                                                                push(op)
-                                                                push(nWords)
-                                                        for value in args[:nWords]:
-                                                                assert -32768 <= value < 32768, "PUSH value out of range %d" % value
-                                                                push((value >> 8) & 0xff)
-                                                                push(value & 0xff)
-
-                                                # Write bytes
-                                                if nBytes:
-                                                        pass
-                                                        if nBytes <= 8:
-                                                                op, argBits = streamMnemonicDict["PUSHB"]
-                                                                op = op + nBytes - 1
-                                                                push(op)
-                                                        else:
-                                                                op, argBits = streamMnemonicDict["NPUSHB"]
-                                                                push(op)
-                                                                push(nBytes)
-                                                        for value in args[nWords:nWords+nBytes]:
-                                                                push(value)
-
-                                                nTotal = nWords + nBytes
-                                                args = args[nTotal:]
-                                                nArgs -= nTotal
-                                                nWords = 0
+                                        assemblePush(args, push)
                                 else:
                                         # Write exactly what we've been asked to
                                         words = mnemonic[-1] == "W"
@@ -64,6 +64,8 @@ usage: ttx [options] inputfile1 [... inputfileN]
        valid when at most one TTX file is specified.
     -b Don't recalc glyph bounding boxes: use the values in the TTX
        file as-is.
+    -j <number> Compile the independent tables (GSUB, GPOS, CFF, cmap,
+       name, post...) in that many processes.
 """
 
 
@@ -113,6 +115,7 @@ class Options(object):
 	allowVID = False
 	ignoreDecompileErrors = True
 	bitmapGlyphDataFormat = 'raw'
+	processes = 1
 
 	def __init__(self, rawOptions, numFiles):
 		self.onlyTables = []
@@ -159,6 +162,8 @@ class Options(object):
 				self.mergeFile = value
 			elif option == "-b":
 				self.recalcBBoxes = False
+			elif option == "-j":
+				self.processes = int(value)
 			elif option == "-a":
 				self.allowVID = True
 			elif option == "-e":
@@ -214,7 +219,7 @@ def ttCompile(input, output, options):
 			recalcBBoxes=options.recalcBBoxes,
 			verbose=options.verbose, allowVID=options.allowVID)
 	ttf.importXML(input, quiet=options.quiet)
-	ttf.save(output)
+	ttf.save(output, processes=options.processes)
 
 	if options.verbose:
 		import time
@@ -254,7 +259,7 @@ def guessFileType(fileName):
 
 def parseOptions(args):
 	try:
-		rawOptions, files = getopt.getopt(args, "ld:o:vqht:x:sim:z:baey:")
+		rawOptions, files = getopt.getopt(args, "ld:o:vqht:x:sim:z:baey:j:")
 	except getopt.GetoptError:
 		usage()
 	